@@ -0,0 +1,192 @@
+"""
+离线基准测试：启动本地模拟服务器（mock_server.py），在临时目录中运行下载流程并汇总性能数据
+
+每个场景在独立的子进程和临时工作目录中运行（全新的数据库、缓存和图片目录），互不影响：
+    comic  逐本调用 main.download_comic 下载漫画列表中的漫画（线程引擎）
+    main   完整运行 main.main()：登录、收藏夹、订阅、分批下载，--engine 指定下载引擎
+
+输出每个场景的图片/秒、接口与图片请求的p50/p99延迟、峰值内存（RSS）和数据库耗时，
+--output 指定时另存为JSON，便于对比不同提交的结果。
+
+用法：
+    python bench/bench.py --scenario main comic --engine thread asyncio --latency 20 --error-rate 0.02
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+
+# 基准测试的配置：在仓库配置文件的基础上覆盖这些项
+BENCH_CONFIG = {
+    "global": {"USER_NAME": "bench", "USER_PASSWORD": "bench"},
+    "pdf": {"pdf_switch": 0},
+    "cache": {"db_path": "./cache/http_cache.db"},
+    "metrics": {"enabled": True, "summary_dir": "./logs", "prometheus_port": 0},
+    "download": {
+        "key_world": "bench",
+        "filter": "none",
+        "page": 1,
+        "time_budget": 0,
+        "output_format": "folder",
+        "recompress": "none",
+    },
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"模拟服务器没有在{timeout}秒内启动")
+
+def write_config(workdir: str, api_base: str, engine: str, threads: int, download_plan: int):
+    import yaml
+    with open(os.path.join(ROOT_DIR, "config", "comic.yaml"), encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    for section, values in BENCH_CONFIG.items():
+        config.setdefault(section, {}).update(values)
+    config["global"]["api_base"] = api_base
+    config["download"].update({"engine": engine, "thread_number": threads, "download_plan": download_plan})
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    with open(os.path.join(workdir, "config", "comic.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+def run_worker(scenario: str) -> dict:
+    """在子进程中运行一个场景（当前目录为临时工作目录），返回性能数据"""
+    sys.path.insert(0, SRC_DIR)
+    import main as app
+    from metrics import metrics
+    start = time.monotonic()
+    if scenario == "main":
+        app.main([])
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        from api import login, get_old_update
+        from database import ComicSQLiteDB
+        from pipeline import BoundedExecutor
+        from util import get_config
+        app.db = ComicSQLiteDB("./data/comic_spider.db")
+        login()
+        comics = get_old_update(1)["docs"]
+        thread_number = int(get_config("download", "thread_number", 5))
+        max_inflight = int(get_config("download", "max_inflight", 64))
+        with ThreadPoolExecutor(max_workers=thread_number) as pool:
+            executor = BoundedExecutor(pool, max_inflight)
+            for comic in comics:
+                app.download_comic(comic, executor)
+        app.db.close()
+    elapsed = time.monotonic() - start
+    api = metrics.histogram("http_request_seconds")
+    images = metrics.histogram("http_request_seconds", endpoint="static")
+    downloads = metrics.histogram("download_seconds")
+    db_time = metrics.histogram("db_commit_seconds").sum + metrics.histogram("db_call_seconds").sum
+    downloaded = metrics.counter_total("images_total", result="downloaded")
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "images": int(downloaded),
+        "images_per_second": round(downloaded / elapsed, 2) if elapsed else 0,
+        "mb_per_second": round(metrics.counter_total("download_bytes_total") / elapsed / 1024 / 1024, 2)
+        if elapsed else 0,
+        "requests": api.count,
+        "request_p50_ms": round(api.quantile(0.5) * 1000, 1),
+        "request_p99_ms": round(api.quantile(0.99) * 1000, 1),
+        "image_p50_ms": round(images.quantile(0.5) * 1000, 1),
+        "image_p99_ms": round(images.quantile(0.99) * 1000, 1),
+        "download_p99_ms": round(downloads.quantile(0.99) * 1000, 1),
+        "retries": int(metrics.counter_total("download_retries_total") + metrics.counter_total("http_retries_total")),
+        "db_seconds": round(db_time, 3),
+        # Linux下 ru_maxrss 的单位为KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def run_case(scenario: str, engine: str, args, api_base: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"pika-bench-{scenario}-")
+    try:
+        write_config(workdir, api_base, engine, args.threads, args.download_plan)
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        for key in ("API_BASE", "USER_NAME", "USER_PASSWORD"):
+            # 环境变量优先于配置文件，避免误连真实接口（新旧两种写法都要去掉）
+            env.pop(key, None)
+            env.pop(f"GLOBAL_{key}", None)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", scenario],
+                              cwd=workdir, env=env, capture_output=True, text=True, timeout=args.timeout)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{scenario}/{engine} 运行失败：\n{proc.stderr[-4000:]}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"工作目录：{workdir}", file=sys.stderr)
+    return {"scenario": scenario, "engine": engine, **result}
+
+def print_table(results: list):
+    columns = ["scenario", "engine", "images", "elapsed_seconds", "images_per_second", "mb_per_second",
+               "request_p50_ms", "request_p99_ms", "image_p99_ms", "retries", "db_seconds", "peak_rss_mb"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("--scenario", nargs="+", choices=["comic", "main"], default=["main"])
+    parser.add_argument("--engine", nargs="+", choices=["thread", "asyncio"], default=["thread"],
+                        help="main 场景使用的下载引擎（comic 场景固定为线程引擎）")
+    parser.add_argument("--threads", type=int, default=5, help="download.thread_number")
+    parser.add_argument("--download-plan", type=int, default=1, help="分批下载的页数（每页20本）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个场景重复运行的次数")
+    parser.add_argument("--timeout", type=float, default=600, help="单个场景的超时时间（秒）")
+    parser.add_argument("--output", help="结果另存为JSON")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    # 其余参数（--comics、--latency、--error-rate、--image-kb 等）传给 mock_server.py
+    return parser.parse_known_args(argv)
+
+def main(argv=None):
+    args, server_args = parse_args(argv)
+    if args.worker:
+        print(json.dumps(run_worker(args.worker)))
+        return
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mock_server.py"),
+                               "--port", str(port), *server_args],
+                              stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for_port(port)
+        api_base = f"http://127.0.0.1:{port}/"
+        for scenario in args.scenario:
+            engines = args.engine if scenario == "main" else ["thread"]
+            for engine in engines:
+                for _ in range(args.repeat):
+                    results.append(run_case(scenario, engine, args, api_base))
+    finally:
+        server.terminate()
+        server.wait()
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"server_args": server_args, "threads": args.threads, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+本地模拟的哔咔接口服务器，供基准测试使用（只依赖标准库）
+
+实现了 src/api.py 用到的接口：登录、收藏夹、章节列表、章节图片列表、漫画详情、
+高级搜索、漫画列表（分批下载），以及图片静态文件。
+漫画按编号分为三组：前 --favourites 本在收藏夹中，随后 --searched 本是搜索结果，其余在漫画列表中。
+与官方一样，图片由另一个地址（--image-port）提供，不签名，也不和接口共用限速器。
+
+用法：
+    python bench/mock_server.py --port 8777 --comics 20 --eps 5 --pages 40 --latency 20 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 与官方接口相同的分页大小
+COMICS_LIMIT = 20
+EPS_LIMIT = 40
+PAGES_LIMIT = 40
+
+# 标准亮度Huffman表（ITU T.81 附录K）
+DC_BITS = bytes([0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0])
+DC_VALUES = bytes(range(12))
+AC_BITS = bytes([0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D])
+AC_VALUES = bytes.fromhex(
+    "01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728"
+    "292a3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a83848586878889"
+    "8a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2"
+    "e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9fa")
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack(">BBH", 0xFF, marker, len(payload) + 2) + payload
+
+def gray_jpeg(width: int, height: int, size: int) -> bytes:
+    """
+    生成一张可以正常解码的灰色基线JPEG（只依赖标准库），用注释段把文件补足到 size 字节
+    每个8x8块都是中灰：DC差值为0（编码00）、没有AC系数（EOB，编码1010）
+    """
+    blocks = ((width + 7) // 8) * ((height + 7) // 8)
+    bits = "001010" * blocks
+    bits += "1" * (-len(bits) % 8)
+    scan = int(bits, 2).to_bytes(len(bits) // 8, "big")
+    header = (
+        segment(0xE0, b"JFIF\0\x01\x01\0\0\x01\0\x01\0\0")
+        + segment(0xDB, b"\0" + b"\x01" * 64)
+        + segment(0xC0, struct.pack(">BHHB", 8, height, width, 1) + b"\x01\x11\0")
+        + segment(0xC4, b"\x00" + DC_BITS + DC_VALUES + b"\x10" + AC_BITS + AC_VALUES)
+        + segment(0xDA, b"\x01\x01\x00\x00\x3f\x00")
+    )
+    padding = []
+    remaining = size - (2 + len(header) + len(scan) + 2)
+    rng = random.Random(0)
+    while remaining > 4:
+        length = min(remaining - 4, 65533 - 2)
+        padding.append(segment(0xFE, rng.randbytes(length)))
+        remaining -= length + 4
+    return b"\xff\xd8" + b"".join(padding) + header + scan + b"\xff\xd9"
+
+class MockPica:
+    """模拟数据和请求统计"""
+    def __init__(self, comics: int, favourites: int, searched: int, eps: int, pages: int,
+                 image_kb: float, latency_ms: float, jitter_ms: float, error_rate: float,
+                 image_latency_ms: float, base_url: str):
+        self.comics = comics
+        self.favourites = min(favourites, comics)
+        self.searched = min(searched, comics - self.favourites)
+        self.eps = eps
+        self.pages = pages
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.image_latency = image_latency_ms / 1000
+        self.error_rate = error_rate
+        self.base_url = base_url
+        # 可以解码的JPEG（开启PDF导出、重新压缩时也能处理），不足 image_kb 的部分用注释段补齐
+        self.image = gray_jpeg(800, 1200, int(image_kb * 1024))
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def comic_id(index: int) -> str:
+        # 与官方ID一样是24位十六进制
+        return f"{index:024x}"
+
+    def comic(self, index: int) -> dict:
+        return {
+            "_id": self.comic_id(index),
+            "title": f"Bench Comic {index}",
+            "author": "bench",
+            "categories": ["bench"],
+            "pagesCount": self.eps * self.pages,
+            "epsCount": self.eps,
+            "finished": False,
+            "updated_at": "2026-01-01T00:00:00.000Z",
+            "isFavourite": index < self.favourites,
+        }
+
+    def record(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def delay(self, image: bool):
+        base = self.image_latency if image else self.latency
+        if base or self.jitter:
+            time.sleep(max(base + random.uniform(-self.jitter, self.jitter), 0))
+
+def paged(items: list, page: int, limit: int) -> dict:
+    pages = max((len(items) + limit - 1) // limit, 1)
+    return {"docs": items[(page - 1) * limit: page * limit], "total": len(items),
+            "limit": limit, "page": page, "pages": pages}
+
+def make_handler(mock: MockPica, images: bool):
+    """images 为True时是图片服务器，只提供 /static/ 下的图片；否则是接口服务器"""
+    comic_range = {
+        "favourite": range(0, mock.favourites),
+        "search": range(mock.favourites, mock.favourites + mock.searched),
+        "all": range(mock.favourites + mock.searched, mock.comics),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, data=None, status: int = 200, body: bytes = None, content_type="application/json"):
+            if body is None:
+                body = json.dumps({"code": status, "data": data}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_request(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            url = urlparse(self.path)
+            path = url.path
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            is_image = path.startswith("/static/")
+            if is_image != images:
+                return self.send(status=404)
+            mock.record("static" if is_image else re.sub(r"/[0-9a-f]{24}|/\d+", "/:id", path))
+            mock.delay(is_image)
+            if mock.error_rate and random.random() < mock.error_rate:
+                return self.send(status=503)
+            if is_image:
+                return self.send(body=mock.image, content_type="image/jpeg")
+            if path == "/auth/sign-in":
+                return self.send({"token": "bench-token"})
+            if path == "/users/favourite":
+                return self.send({"comics": paged([mock.comic(i) for i in comic_range["favourite"]], page,
+                                                  COMICS_LIMIT)})
+            if path == "/comics/advanced-search":
+                return self.send({"comics": paged([mock.comic(i) for i in comic_range["search"]], page,
+                                                  COMICS_LIMIT)})
+            if path == "/comics":
+                return self.send({"comics": paged([mock.comic(i) for i in comic_range["all"]], page,
+                                                  COMICS_LIMIT)})
+            match = re.match(r"^/comics/([0-9a-f]{24})(/.*)?$", path)
+            if not match:
+                return self.send(status=404)
+            index, rest = int(match.group(1), 16), match.group(2) or ""
+            if index >= mock.comics:
+                return self.send(status=404)
+            if rest == "":
+                return self.send({"comic": mock.comic(index)})
+            if rest == "/favourite":
+                return self.send({"action": "un_favourite"})
+            if rest == "/eps":
+                # 与官方接口一样按新到旧排列
+                eps = [{"_id": f"{index:012x}{order:012x}", "title": f"第{order}話", "order": order}
+                       for order in range(mock.eps, 0, -1)]
+                return self.send({"eps": paged(eps, page, EPS_LIMIT)})
+            match = re.match(r"^/order/(\d+)/pages$", rest)
+            if match:
+                order = int(match.group(1))
+                docs = [{"media": {"fileServer": mock.base_url,
+                                   "path": f"{mock.comic_id(index)}/{order}/{n:04d}.jpg"}}
+                        for n in range(mock.pages)]
+                return self.send({"pages": paged(docs, page, PAGES_LIMIT)})
+            return self.send(status=404)
+
+        do_GET = do_POST = handle_request
+
+    return Handler
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟的哔咔接口服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8777)
+    parser.add_argument("--image-port", type=int, default=0, help="图片服务器的端口（0为随机分配）")
+    parser.add_argument("--comics", type=int, default=20, help="漫画总数")
+    parser.add_argument("--favourites", type=int, default=5, help="收藏夹中的漫画数")
+    parser.add_argument("--searched", type=int, default=5, help="搜索结果中的漫画数")
+    parser.add_argument("--eps", type=int, default=5, help="每本漫画的章节数")
+    parser.add_argument("--pages", type=int, default=40, help="每个章节的图片数")
+    parser.add_argument("--image-kb", type=float, default=200, help="每张图片的大小（KB）")
+    parser.add_argument("--latency", type=float, default=20, help="接口响应延迟（毫秒）")
+    parser.add_argument("--image-latency", type=float, default=20, help="图片响应延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=5, help="延迟的随机抖动范围（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的概率")
+    return parser.parse_args(argv)
+
+def create_server(args) -> ThreadingHTTPServer:
+    """创建接口服务器，图片服务器为其 image_server 属性（调用方负责启动）"""
+    image_server = ThreadingHTTPServer((args.host, args.image_port), None)
+    image_port = image_server.server_address[1]
+    mock = MockPica(args.comics, args.favourites, args.searched, args.eps, args.pages, args.image_kb,
+                    args.latency, args.jitter, args.error_rate, args.image_latency,
+                    f"http://{args.host}:{image_port}")
+    image_server.RequestHandlerClass = make_handler(mock, images=True)
+    image_server.daemon_threads = True
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock, images=False))
+    server.daemon_threads = True
+    server.mock = mock
+    server.image_server = image_server
+    return server
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = create_server(args)
+    threading.Thread(target=server.image_server.serve_forever, daemon=True).start()
+    print(f"mock pica api on http://{args.host}:{args.port}/, images on {server.mock.base_url}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.image_server.shutdown()
+        print(json.dumps(server.mock.requests, ensure_ascii=False), flush=True)
@@ -0,0 +1,512 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from time import monotonic
+from functools import partial
+from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from api import (api_base, media_url, comic_version, request_headers, get_response_cache)
+from sync import sync_plan, filter_downloaded
+from archive import open_chapter_archive
+from blobstore import get_blob_store, media_path_of
+from postprocess import submit_chapter
+from ratelimit import get_limiter, backoff_delay, retry_delay, HostSlot, RETRY_STATUS
+from budget import BudgetExhausted, get_time_budget
+from metrics import metrics, endpoint_of, DURATION_BUCKETS
+from events import emit_event
+from util import get_config, convert_file_name, ensure_valid_path
+from logger import  logger
+
+class AsyncHttp:
+    """
+    asyncio引擎的HTTP客户端（aiohttp）
+
+    与 api.http_do 使用相同的请求头和签名、主机自适应限流器（协程方式等待名额）、退避重试和指标，
+    等待响应时不占用线程，同时进行中的请求数只受限流器和连接数上限约束。
+    """
+    def __init__(self, limit: int):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max(limit, 1), ssl=False),
+            timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=10),
+            trust_env=True,
+        )
+
+    async def request(self, method: str, url: str, handler, retries=3, extra_headers: dict = None, **kwargs):
+        """
+        发送请求，超时、连接错误或返回429/5xx时按带抖动的指数退避重试
+        :param handler: 协程函数，以响应为参数读取正文；读完正文之后才释放主机的并发名额，
+                        读取正文时的超时和连接中断同样计为拥塞
+        :return: handler 的返回值
+        """
+        header = request_headers(method, url, extra_headers)
+        host = urlparse(url).netloc
+        endpoint = endpoint_of(url)
+        limiter = get_limiter(host)
+        for attempt in range(retries + 1):
+            await limiter.acquire_async()
+            slot = HostSlot(limiter)
+            start = monotonic()
+            status = None
+            try:
+                async with self.session.request(method, url, headers=header, **kwargs) as response:
+                    status = response.status
+                    metrics.observe("http_request_seconds", monotonic() - start, endpoint=endpoint, host=host)
+                    metrics.inc("http_requests_total", host=host, status=status)
+                    if status >= 400:
+                        emit_event("http_error", host=host, endpoint=endpoint, status=status,
+                                   duration=round(monotonic() - start, 3))
+                    congested = status in RETRY_STATUS
+                    if not congested or attempt >= retries:
+                        result = await handler(response)
+                        slot.release(congested=congested)
+                        return result
+                    delay = retry_delay(response, attempt)
+                slot.release(congested=True)
+                logger.warning(f"请求{url}返回{status}，{delay:.1f}秒后重试")
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                slot.release(congested=True)
+                if status is None:
+                    metrics.observe("http_request_seconds", monotonic() - start, endpoint=endpoint, host=host)
+                    metrics.inc("http_requests_total", host=host, status=type(e).__name__)
+                emit_event("http_error", host=host, endpoint=endpoint, status=type(e).__name__,
+                           duration=round(monotonic() - start, 3))
+                if attempt >= retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"请求{url}失败：{e!r}，{delay:.1f}秒后重试")
+            finally:
+                # 其他异常不是拥塞，但名额同样要释放
+                slot.release(congested=False)
+            metrics.inc("http_retries_total", host=host)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def read_body(response) -> tuple:
+        return response.status, response.headers, await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+class AsyncEngine:
+    """
+    基于asyncio的下载引擎（download.engine: asyncio，需要安装aiohttp）
+
+    章节列表、图片地址和图片下载都是事件循环中的协程，HTTP请求不占用线程；
+    同时下载中的图片数不超过 max_inflight，同一主机的并发由自适应限流器控制。
+    数据库读取、响应缓存、图片仓库、压缩包等阻塞的本地操作在 io_workers 个线程中执行。
+    """
+    def __init__(self, db, max_inflight: int, io_workers: int):
+        self.db = db
+        self.max_inflight = max(max_inflight, 1)
+        self.executor = ThreadPoolExecutor(max_workers=max(io_workers, 1), thread_name_prefix="asyncio-io")
+        self.http: AsyncHttp = None
+        self._images: asyncio.Semaphore = None
+
+    async def start(self):
+        """在事件循环中创建HTTP会话"""
+        self.http = AsyncHttp(self.max_inflight)
+        self._images = asyncio.Semaphore(self.max_inflight)
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+
+    async def io(self, fn, *args, **kwargs):
+        """在线程池中执行阻塞的本地操作"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def cached_get(self, endpoint: str, url: str, version: str = None) -> dict:
+        """api.cached_get 的协程版本：GET元数据接口，开启缓存时优先使用缓存并按 ETag 重新验证"""
+        cache = get_response_cache()
+        if cache is None:
+            _, _, body = await self.http.request("GET", url, AsyncHttp.read_body)
+            return json.loads(body)
+        entry = await self.io(cache.get, url)
+        if entry is not None and cache.is_fresh(entry, endpoint, version):
+            return json.loads(entry.body)
+        conditional = {}
+        if entry is not None and entry.etag:
+            conditional["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            conditional["If-Modified-Since"] = entry.last_modified
+        status, response_headers, body = await self.http.request("GET", url, AsyncHttp.read_body,
+                                                                 extra_headers=conditional)
+        if status == 304 and entry is not None:
+            await self.io(cache.refresh, url, version)
+            return json.loads(entry.body)
+        data = json.loads(body)
+        if status == 200 and "data" in data:
+            await self.io(cache.put, url, endpoint, body, response_headers.get("ETag"),
+                          response_headers.get("Last-Modified"), version)
+        return data
+
+    async def comic_info(self, cid, version=None) -> dict:
+        return await self.cached_get("comic_info", f"{api_base}comics/{cid}", version)
+
+    async def episodes_page(self, cid, page, version=None) -> dict:
+        return (await self.cached_get("eps", f"{api_base}comics/{cid}/eps?page={page}", version))["data"]["eps"]
+
+    async def episodes_all(self, cid, title, version=None) -> list:
+        """api.episodes_all 的协程版本：先取第一页得到总页数，其余页同时请求"""
+        try:
+            first_page = await self.episodes_page(cid, 1, version)
+            other_pages = await asyncio.gather(*(
+                self.episodes_page(cid, page, version) for page in range(2, first_page["pages"] + 1)
+            ))
+            episodes = list(first_page["docs"])
+            for page_data in other_pages:
+                episodes.extend(page_data["docs"])
+            episodes.sort(key=lambda episode: episode["order"])
+            if len(episodes) != first_page["total"]:
+                raise Exception(f'wrong number of episodes,expect:{first_page["total"]},actual:{len(episodes)}')
+        except KeyError as e:
+            logger.error(f"Comic {title} has been MISSING. KeyError: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"An error occurred while fetching episodes for comic {title}. Error: {e}")
+            return []
+        return episodes
+
+    async def episodes_since(self, cid, title, min_order: int, version=None) -> list:
+        """api.episodes_since 的协程版本：按新到旧逐页获取序号大于 min_order 的章节"""
+        episodes = []
+        page = 1
+        try:
+            while True:
+                eps = await self.episodes_page(cid, page, version)
+                newer = [episode for episode in eps["docs"] if episode["order"] > min_order]
+                episodes.extend(newer)
+                if len(newer) < len(eps["docs"]) or page >= eps["pages"]:
+                    break
+                page += 1
+        except KeyError as e:
+            logger.error(f"Comic {title} has been MISSING. KeyError: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"An error occurred while fetching episodes for comic {title}. Error: {e}")
+            return []
+        return sorted(episodes, key=lambda episode: episode["order"])
+
+    async def pending_episodes(self, comic, incremental: bool):
+        """sync.pending_episodes 的协程版本，同步状态的判断与线程引擎相同"""
+        plan = sync_plan(self.db, comic, incremental)
+        if plan is None:
+            return None
+        state, min_order = plan
+        version = comic_version(comic)
+        if min_order is not None:
+            episodes = await self.episodes_since(comic["_id"], comic["title"], min_order, version)
+        else:
+            episodes = await self.episodes_all(comic["_id"], comic["title"], version)
+        return filter_downloaded(self.db, comic["_id"], state, episodes, incremental)
+
+    async def list_images(self, cid, order, version=None) -> list:
+        """并发获取章节的全部图片地址：先取第一页得到总页数，其余页同时请求"""
+        url = f"{api_base}comics/{cid}/order/{order}/pages?page="
+        first_page = (await self.cached_get("pages", url + "1", version))["data"]["pages"]
+        docs = list(first_page["docs"])
+        other_pages = await asyncio.gather(*(
+            self.cached_get("pages", url + str(page), version)
+            for page in range(2, first_page["pages"] + 1)
+        ))
+        for page_data in other_pages:
+            docs.extend(page_data["data"]["pages"]["docs"])
+        return [media_url(doc['media']) for doc in docs]
+
+    async def download(self, name_len, folder_path, i: int, url: str, archive=None) -> tuple:
+        """downloader.download 的协程版本，返回 (文件大小, 内容的sha1)，文件已存在时sha1为None"""
+        name = str(i + 1).zfill(name_len) + '.jpg'
+        path = os.path.join(folder_path, name)
+        if archive is not None:
+            size = archive.size_of(name)
+            if size is not None:
+                return size, None
+        async with self._images:
+            result = await self.download_file(path, url, keep_blob=archive is None)
+        if archive is not None:
+            await self.io(archive.add, path, name)
+        return result
+
+    async def download_file(self, path: str, url: str, keep_blob: bool = True) -> tuple:
+        store = get_blob_store()
+        media_path = media_path_of(url)
+        host = urlparse(url).netloc
+        start = monotonic()
+        existing = await self.io(_existing_image, store, media_path, path)
+        if existing is not None:
+            return existing
+        try:
+            size, sha1 = await self.http.request("GET", url, partial(_save_image, path, self.io), retries=2)
+            if store is not None and keep_blob:
+                await self.io(store.add, media_path, path, sha1, size)
+        except Exception as e:
+            metrics.inc("images_total", result="failed")
+            raise Exception(f"Failed to download {url}: {e!r}")
+        metrics.observe("download_seconds", monotonic() - start, host=host)
+        metrics.inc("download_bytes_total", size, host=host)
+        metrics.inc("images_total", result="downloaded")
+        return size, sha1
+
+    async def download_episode(self, comic, episode, comic_path, is_detail, use_ledger):
+        """下载一个章节，时间预算不足以开始该章节时抛出 BudgetExhausted"""
+        budget = get_time_budget()
+        estimate = budget.episode_images(comic)
+        if not budget.try_start(estimate):
+            raise BudgetExhausted()
+        fetched = 0
+        try:
+            fetched = await self._download_episode(comic, episode, comic_path, is_detail, use_ledger)
+        finally:
+            budget.finish(estimate, fetched)
+
+    async def _download_episode(self, comic, episode, comic_path, is_detail, use_ledger) -> int:
+        """:return: 本次实际下载的图片数"""
+        started = monotonic()
+        cid = comic["_id"]
+        title = comic["title"]
+        episode_title = episode["title"]
+        chapter_title = convert_file_name(episode_title)
+        chapter_path = Path(comic_path, chapter_title)
+        chapter_path.mkdir(parents=True, exist_ok=True)
+        images = await self.io(self.db.get_episode_images, cid, episode["order"]) if use_ledger else []
+        if images:
+            # 从下载记录恢复：不再请求图片列表，已完成的图片直接跳过
+            done_count = sum(1 for image in images if image["status"] == "done")
+            logger.info("从下载记录恢复章节%s：共%d张，已完成%d张", episode_title, len(images), done_count)
+        else:
+            image_urls = await self.list_images(cid, episode["order"], comic_version(comic))
+            if not image_urls:
+                logger.warning(f"{title}{chapter_title}没有找到图片")
+                return 0
+            logger.info("找到 %d 张图片在:%s", len(image_urls), chapter_title)
+            if use_ledger:
+                await self.io(self.db.save_episode_images, cid, episode["order"], image_urls)
+            images = [{"page_index": index, "url": image_url, "status": "pending"}
+                      for index, image_url in enumerate(image_urls)]
+        name_len = 3 if len(images) < 1000 else 4
+        archive = await self.io(open_chapter_archive, chapter_path)
+        # 输出为压缩包时以压缩包中的内容为准，download 会跳过已在压缩包中的图片
+        todo = [image for image in images if image["status"] != "done" or archive is not None]
+        outcomes = await asyncio.gather(*(
+            self.download(name_len, chapter_path, image["page_index"], image["url"], archive)
+            for image in todo
+        ), return_exceptions=True)
+        downloaded_count = len(images) - len(todo)
+        results = []
+        for image, outcome in zip(todo, outcomes):
+            if isinstance(outcome, Exception):
+                results.append((image["page_index"], "failed", None, None))
+                logger.error(f"Error downloading the {image['page_index'] + 1}-th image"
+                             f"in episode:{episode_title}"
+                             f"in comic:{title}"
+                             f"Exception:{outcome}")
+            else:
+                downloaded_count += 1
+                results.append((image["page_index"], "done", *outcome))
+        if archive is not None:
+            await self.io(archive.close, complete=downloaded_count == len(images))
+        if use_ledger and results:
+            await self.io(self.db.update_images_status, cid, episode["order"], results)
+        if is_detail:
+            logger.info(
+                f"[episode:{episode_title:<10}] "
+                f"downloaded:{downloaded_count:>6}, "
+                f"total:{len(images):>4}, "
+                f"progress:{int(downloaded_count / len(images) * 100):>3}%",
+            )
+        if downloaded_count == len(images):
+            await self.io(self.db.update_downloaded_episodes, cid, episode_title, episode.get("_id"),
+                          episode["order"])
+            await self.io(submit_chapter, self.db, cid, episode, chapter_path, archive)
+        else:
+            logger.error(
+                f"Failed to download the episodes:{episode_title} "
+                f"of comic:{title}. "
+                f"Currently, {downloaded_count} images(total_images:{len(images)}) "
+                "from this episode have been downloaded"
+            )
+        fetched = [result for result in results if result[1] == "done"]
+        emit_event("episode", comic_id=cid, title=title, episode=episode_title, order=episode["order"],
+                   images=len(images), downloaded=len(fetched), failed=len(images) - downloaded_count,
+                   bytes=sum(result[2] or 0 for result in fetched), duration=round(monotonic() - started, 3),
+                   status="ok" if downloaded_count == len(images) else "incomplete")
+        return len(fetched)
+
+    async def download_comic(self, comic) -> bool:
+        """
+        下载漫画中未下载的章节，全部章节同时进行，增量模式下漫画没有更新时返回False
+        时间预算不足时，等已开始的章节下载完后抛出 BudgetExhausted
+        """
+        cid = comic["_id"]
+        title = comic["title"]
+        logger.info("开始检查%s是否存在未下载章节", title)
+        incremental = get_config("download", "incremental", False)
+        episodes = await self.pending_episodes(comic, incremental)
+        if episodes is None:
+            return False
+        num_pages = comic["pagesCount"] if "pagesCount" in comic else -1
+        is_detail = get_config("download", "is_detail")
+        use_ledger = get_config("download", "image_ledger", False)
+        if not episodes:
+            logger.info(f"{title}中没有可下载章节")
+            return True
+        logger.info(
+            '正在下载:[%s]-[%s]-[%s]-[total_pages:%d]' %
+            (title, comic["author"], comic["categories"], num_pages)
+        )
+        logger.debug("待下载章节：%s", episodes)
+        await self.io(self.db.mark_comic_as_downloaded, cid)
+        comic_path = ensure_valid_path(os.path.join(".", "comics", convert_file_name(title)))
+        outcomes = await asyncio.gather(*(
+            self.download_episode(comic, episode, comic_path, is_detail, use_ledger)
+            for episode in episodes
+        ), return_exceptions=True)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        for error in errors:
+            if not isinstance(error, BudgetExhausted):
+                raise error
+        if errors:
+            raise BudgetExhausted()
+        return True
+
+def _existing_image(store, media_path: str, path: str):
+    """图片已在章节目录中或能从图片仓库链接时返回 (文件大小, sha1)，否则返回None"""
+    if os.path.exists(path):
+        metrics.inc("images_total", result="exists")
+        return os.path.getsize(path), None
+    if store is not None:
+        linked = store.link_to(media_path, path)
+        if linked is not None:
+            metrics.inc("images_total", result="linked")
+            return linked
+    return None
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def _save_image(path: str, io, response, chunk_size: int = 64 * 1024, batch_size: int = 256 * 1024) -> tuple:
+    """
+    边接收边写入临时文件，下载完整后再原子重命名（同 downloader.save_response_stream）
+    文件的打开、写入和重命名都通过 io（见 AsyncEngine.io）在线程池中执行，
+    收到的数据攒够 batch_size 再写一次，慢速磁盘不会阻塞事件循环
+    :return: (写入的字节数, 内容的sha1)
+    """
+    if response.status != 200:
+        raise IOError(f"status code: {response.status}")
+    tmp_path = path + ".part"
+    written = 0
+    sha1 = hashlib.sha1()
+    buffer = []
+    buffered = 0
+    f = await io(open, tmp_path, 'wb')
+    try:
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                sha1.update(chunk)
+                written += len(chunk)
+                buffer.append(chunk)
+                buffered += len(chunk)
+                if buffered >= batch_size:
+                    await io(f.write, b"".join(buffer))
+                    buffer.clear()
+                    buffered = 0
+            if buffer:
+                await io(f.write, b"".join(buffer))
+        finally:
+            await io(f.close)
+        expected = response.headers.get("Content-Length")
+        # 有压缩编码时 Content-Length 是压缩后的长度，无法直接比较
+        if expected is not None and not response.headers.get("Content-Encoding"):
+            if int(expected) != written:
+                raise IOError(f"图片不完整，期望{expected}字节，实际{written}字节")
+        await io(os.replace, tmp_path, path)
+        return written, sha1.hexdigest()
+    except BaseException:
+        await io(_remove_if_exists, tmp_path)
+        raise
+
+class AsyncPipeline:
+    """
+    asyncio引擎的下载流水线，接口与 pipeline.DownloadPipeline 相同
+
+    事件循环运行在后台线程中，三种来源的漫画进入同一个持久化任务队列（见 jobqueue.JobQueue），
+    由 comic_workers 个协程按优先级领取处理。
+    """
+    def __init__(self, db, jobs, on_detail=None):
+        """
+        :param db: ComicSQLiteDB 实例
+        :param jobs: JobQueue 实例
+        :param on_detail: 每本漫画下载完成后，以 (comic_info的返回值, check_favourite) 回调
+        """
+        thread_number = int(get_config("download", "thread_number", 5))
+        max_inflight = int(get_config("download", "max_inflight", 64))
+        self.comic_workers = max(int(get_config("download", "comic_workers", 2)), 1)
+        self.engine = AsyncEngine(db, max_inflight, thread_number)
+        self.jobs = jobs
+        self.on_detail = on_detail
+        # 领取任务会阻塞等待，单独使用线程，不占用本地操作的线程
+        self._job_executor = ThreadPoolExecutor(max_workers=self.comic_workers, thread_name_prefix="asyncio-jobs")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete,
+                                        args=(self._main(),), name="asyncio-engine", daemon=True)
+        self._thread.start()
+
+    async def _main(self):
+        await self.engine.start()
+        try:
+            await asyncio.gather(*(self._work() for _ in range(self.comic_workers)))
+        finally:
+            await self.engine.close()
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await loop.run_in_executor(self._job_executor, self.jobs.get)
+            if job is None:
+                return
+            if get_time_budget().expired():
+                self.jobs.release(job)
+                self.jobs.defer()
+                return
+            the_comic = job.payload["comic"]
+            check_favourite = job.payload["check_favourite"]
+            started = monotonic()
+            status = "ok"
+            try:
+                with metrics.timer("comic_seconds", DURATION_BUCKETS):
+                    if await self.engine.download_comic(the_comic) or check_favourite:
+                        info = await self.engine.comic_info(the_comic['_id'], comic_version(the_comic))
+                        if self.on_detail:
+                            await self.engine.io(self.on_detail, info, check_favourite)
+            except BudgetExhausted:
+                # 已开始的章节已经下载完，漫画留到下次运行继续
+                status = "deferred"
+                self.jobs.release(job)
+                self.jobs.defer()
+            except Exception as e:
+                status = "failed"
+                logger.error(
+                    'Download failed for {}, with Exception:{}'.format(the_comic["title"], e)
+                )
+                self.jobs.fail(job, str(e))
+            else:
+                self.jobs.done(job)
+            emit_event("comic", comic_id=the_comic["_id"], title=the_comic["title"], status=status,
+                       attempt=job.attempts, duration=round(monotonic() - started, 3))
+
+    def put(self, comic: dict, priority: int, check_favourite=False):
+        """加入一本待下载的漫画（可在任意线程调用）"""
+        self.jobs.put("comic", comic["_id"], {"comic": comic, "check_favourite": check_favourite}, priority)
+
+    def join(self):
+        """等待队列中的漫画全部处理完，然后关闭事件循环"""
+        self.jobs.close()
+        self._thread.join()
+        self._loop.close()
+        self._job_executor.shutdown(wait=True)
+        self.engine.executor.shutdown(wait=True)
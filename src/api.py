@@ -2,12 +2,22 @@ import hmac
 import hashlib
 import requests
 import json
+import threading
 from util import *
-from time import time
+from time import time, sleep, monotonic
 from urllib.parse import urlencode
 from logger import  logger
-from urllib.parse import quote
-api_base = "https://picaapi.picacomic.com/"
+from urllib.parse import quote, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator
+from session import get_session
+from ratelimit import get_limiter, backoff_delay, retry_delay, HostSlot, RETRY_STATUS
+from cache import ResponseCache
+from metrics import metrics, endpoint_of
+from events import emit_event
+# 接口地址，可用 global.api_base 或环境变量 API_BASE 指向本地的模拟服务器（见 bench/mock_server.py）
+api_base = (get_config("global", "api_base") or "https://picaapi.picacomic.com").rstrip("/") + "/"
 
 headers = {
     "api-key": "C69BAF41DA5ABD1FFEDC6D2FEA56B",
@@ -23,17 +33,62 @@ headers = {
     "image-quality": "original"
 }
 
+# 图片等静态文件服务器不校验签名，只发送最基本的请求头
+static_headers = {
+    "User-Agent": headers["User-Agent"],
+}
+
+secret_key = r"~d}$Q7$eIni=V)9\RK/P.RM4;9[7|@/CA}b~OW!3?EV`:<>M7pddUBL5n|0/*Cn"
+
+class Signer:
+    """
+    API请求签名
+
+    HMAC密钥状态只在创建时计算一次，每次签名复制该状态后再写入待签名字符串；
+    同一秒内相同 (path, method) 的签名直接从缓存返回。
+    """
+    def __init__(self, key: str, nonce: str, api_key: str, cache_size: int = 1024):
+        self._hmac = hmac.new(key.encode(), digestmod=hashlib.sha256)
+        self.nonce = nonce
+        self.api_key = api_key
+        self.sign = lru_cache(maxsize=cache_size)(self._sign)
+
+    def _sign(self, path: str, ts: str, method: str) -> str:
+        hc = self._hmac.copy()
+        hc.update((path + ts + self.nonce + method + self.api_key).lower().encode())
+        return hc.hexdigest()
+
+signer = Signer(secret_key, headers["nonce"], headers["api-key"])
+
 Order_Default = "ua"  # 默认
 Order_Latest = "dd"  # 新到旧
 Order_Oldest = "da"  # 旧到新
 Order_Loved = "ld"  # 最多爱心
 Order_Point = "vd"  # 最多指名
 
-def http_do(method, url, **kwargs):
+def request_headers(method: str, url: str, extra_headers: dict = None) -> dict:
+    """
+    请求头：api_base 下的接口带签名和认证头，图片等静态文件只带最基本的请求头
+    http_do 和 asyncio引擎（见 aio_engine.AsyncHttp）共用
+    """
+    if url.startswith(api_base):
+        header = headers.copy()
+        ts = str(int(time()))
+        header["signature"] = signer.sign(url[len(api_base):], ts, method)
+        header["time"] = ts
+    else:
+        header = static_headers
+    if extra_headers:
+        header = {**header, **extra_headers}
+    return header
+
+def http_do(method, url, retries=3, extra_headers: dict = None, **kwargs):
     """
     执行HTTP请求到API接口。
 
-    此函数自动生成API请求所需的签名，并添加必要的认证头信息。
+    此函数自动生成API请求所需的签名，并添加必要的认证头信息；
+    不属于api_base的地址（图片等静态文件）不签名，也不携带认证头。
+    所有请求共用一个带连接池的会话（见 session.get_session），同一主机的连接会被复用。
     默认禁用SSL证书验证，使用时需注意安全风险。
     参数:
     ----------
@@ -41,8 +96,15 @@ def http_do(method, url, **kwargs):
         HTTP请求方法，如 'GET', 'POST', 'PUT', 'DELETE' 等。
     url : str
         请求的完整URL地址。如果URL包含api_base前缀，签名时会自动移除该前缀。
+    retries : int
+        超时、连接错误或返回429/5xx时的最大重试次数，重试间隔为带抖动的指数退避。
+        每个主机的请求都经过自适应限流器（见 ratelimit.HostLimiter）。
+        stream=True 且返回的不是429/5xx时，主机的并发名额保留到响应关闭（正文读完）为止，
+        读取正文出错时调用方可以先用 response.limiter_slot.release(congested=True) 反馈拥塞。
+    extra_headers : dict, 可选
+        在默认请求头（含签名）之上追加的头信息，如缓存重新验证用的 If-None-Match。
     **kwargs : dict, 可选
-        传递给requests.request的其他参数，如：
+        传递给Session.request的其他参数，如：
         - headers: dict, 额外的HTTP头信息
         - params: dict, URL查询参数
         - data: dict, 请求体数据
@@ -55,18 +117,164 @@ def http_do(method, url, **kwargs):
         包含服务器响应的Response对象。
     """
     kwargs.setdefault("allow_redirects", True)
-    header = headers.copy()
-    ts = str(int(time()))
-    raw = url.replace(api_base, "") + str(ts) + header["nonce"] + method + header["api-key"]
-    secret_key = r"~d}$Q7$eIni=V)9\RK/P.RM4;9[7|@/CA}b~OW!3?EV`:<>M7pddUBL5n|0/*Cn"
-    hc = hmac.new(secret_key.encode(), digestmod=hashlib.sha256)
-    hc.update(raw.lower().encode())
-    header["signature"] = hc.hexdigest()
-    header["time"] = ts
-    kwargs.setdefault("headers", header)
+    kwargs.setdefault("headers", request_headers(method, url, extra_headers))
     proxies = None #代理
-    response = requests.request(method = method, url = url,verify=False,proxies = proxies,timeout = 10, **kwargs)
-    return response
+    host = urlparse(url).netloc
+    endpoint = endpoint_of(url)
+    limiter = get_limiter(host)
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        slot = HostSlot(limiter)
+        held = False
+        try:
+            start = monotonic()
+            try:
+                # 通过全局共享会话发送请求，复用keep-alive连接
+                response = get_session().request(method = method, url = url,verify=False,proxies = proxies,timeout = 10, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                slot.release(congested=True)
+                metrics.observe("http_request_seconds", monotonic() - start, endpoint=endpoint, host=host)
+                metrics.inc("http_requests_total", host=host, status=type(e).__name__)
+                emit_event("http_error", host=host, endpoint=endpoint, status=type(e).__name__,
+                           duration=round(monotonic() - start, 3))
+                if attempt >= retries:
+                    raise
+                metrics.inc("http_retries_total", host=host)
+                delay = backoff_delay(attempt)
+                logger.warning(f"请求{url}失败：{e}，{delay:.1f}秒后重试")
+                sleep(delay)
+                continue
+            congested = response.status_code in RETRY_STATUS
+            # 流式下载时只计到收到响应头为止，正文的接收时间计入 download_seconds
+            metrics.observe("http_request_seconds", monotonic() - start, endpoint=endpoint, host=host)
+            metrics.inc("http_requests_total", host=host, status=response.status_code)
+            if response.status_code >= 400:
+                emit_event("http_error", host=host, endpoint=endpoint, status=response.status_code,
+                           duration=round(monotonic() - start, 3))
+            if not congested and kwargs.get("stream"):
+                hold_until_closed(response, slot)
+                held = True
+                return response
+            slot.release(congested=congested)
+            if not congested or attempt >= retries:
+                return response
+            metrics.inc("http_retries_total", host=host)
+            delay = retry_delay(response, attempt)
+            logger.warning(f"请求{url}返回{response.status_code}，{delay:.1f}秒后重试")
+            response.close()
+            sleep(delay)
+        finally:
+            # 其他异常（ChunkedEncodingError、TooManyRedirects等）不是拥塞，但名额同样要释放
+            if not held:
+                slot.release(congested=False)
+
+def hold_until_closed(response, slot: HostSlot):
+    """流式响应关闭时才释放主机的并发名额，response.limiter_slot 供调用方提前反馈拥塞"""
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            slot.release(congested=False)
+
+    response.limiter_slot = slot
+    response.close = close_and_release
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """获取元数据响应缓存，cache.enabled 关闭时返回None"""
+    global _response_cache
+    if _response_cache is None and get_config("cache", "enabled", False):
+        with _response_cache_lock:
+            if _response_cache is None:
+                ttls = {
+                    "comic_info": float(get_config("cache", "ttl_comic_info", 86400)),
+                    "eps": float(get_config("cache", "ttl_eps", 86400)),
+                    "pages": float(get_config("cache", "ttl_pages", 604800)),
+                }
+                max_bytes = int(get_config("cache", "max_mb", 256)) * 1024 * 1024
+                _response_cache = ResponseCache(get_config("cache", "db_path", "./cache/http_cache.db"), ttls, max_bytes)
+    return _response_cache
+
+def close_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        logger.info(f"响应缓存统计 {_response_cache.summary()}")
+        _response_cache.close()
+        _response_cache = None
+
+def comic_version(comic: dict):
+    """
+    根据列表中的漫画信息生成版本标识，漫画更新（更新时间、章节数、页数、完结状态变化）后随之改变；
+    缓存记录的版本与之相同时不再请求接口
+    """
+    parts = [str(comic.get(key, "")) for key in ("updated_at", "epsCount", "pagesCount", "finished")]
+    return "|".join(parts) if any(parts) else None
+
+def cached_get(endpoint: str, url: str, version: str = None) -> dict:
+    """
+    GET请求元数据接口并返回解析后的JSON，开启缓存时优先使用缓存（见 cache.ResponseCache）。
+    缓存过期后携带 If-None-Match/If-Modified-Since 重新验证，服务器返回304时继续使用缓存；
+    只缓存包含data字段的正常响应。
+    :param endpoint: 接口名（comic_info/eps/pages），决定缓存有效期
+    :param version: 漫画的版本标识（见 comic_version）
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return json.loads(http_do("GET", url).content)
+    entry = cache.get(url)
+    if entry is not None and cache.is_fresh(entry, endpoint, version):
+        return json.loads(entry.body)
+    conditional = {}
+    if entry is not None and entry.etag:
+        conditional["If-None-Match"] = entry.etag
+    if entry is not None and entry.last_modified:
+        conditional["If-Modified-Since"] = entry.last_modified
+    response = http_do("GET", url, extra_headers=conditional)
+    if response.status_code == 304 and entry is not None:
+        cache.refresh(url, version)
+        return json.loads(entry.body)
+    data = json.loads(response.content)
+    if response.status_code == 200 and "data" in data:
+        cache.put(url, endpoint, response.content, response.headers.get("ETag"),
+                  response.headers.get("Last-Modified"), version)
+    return data
+
+def fetch_pages(fetch_page, pages) -> list:
+    """
+    并发获取多个分页，结果按传入的页码顺序返回。
+    :param fetch_page: 接收页码、返回该页数据的函数
+    :param pages: 需要获取的页码列表
+    :return: 与 pages 顺序一致的各页数据
+    """
+    pages = list(pages)
+    if len(pages) <= 1:
+        return [fetch_page(page) for page in pages]
+    # 同时进行中的分页请求数上限
+    max_workers = int(get_config(section="download", key="page_concurrency", default_value=4))
+    with ThreadPoolExecutor(max_workers=min(max(max_workers, 1), len(pages))) as executor:
+        return list(executor.map(fetch_page, pages))
+
+def paginate(fetch_page, first_page: dict = None, max_pages: int = None) -> list:
+    """
+    通用分页器：先获取第1页得到总页数，再并发获取其余页，按页码顺序合并docs。
+    :param fetch_page: 接收页码、返回包含 docs/pages 字段的字典的函数
+    :param first_page: 已经获取到的第1页数据，避免重复请求
+    :param max_pages: 最多获取的页数，默认获取全部
+    :return: 合并后的docs列表
+    """
+    if first_page is None:
+        first_page = fetch_page(1)
+    total_pages = first_page["pages"]
+    if max_pages is not None:
+        total_pages = min(total_pages, max_pages)
+    docs = list(first_page["docs"])
+    for page_data in fetch_pages(fetch_page, range(2, total_pages + 1)):
+        docs.extend(page_data["docs"])
+    return docs
 
 def login():
     """登录API"""
@@ -109,15 +317,15 @@ def my_favourite(page=1):
 
 def my_favourite_all():
     """获取全部收藏夹"""
-    comics = []
-    pages = my_favourite()["pages"]
-    for page in range(1, pages + 1):
-        comics += my_favourite(page)["docs"]
-    return comics
+    return paginate(my_favourite)
 
 def favourite(book_id):
     """收藏/取消收藏本子"""
     url = f"{api_base}comics/{book_id}/favourite"
+    cache = get_response_cache()
+    if cache is not None:
+        # 详情中的 isFavourite 随之改变
+        cache.invalidate(f"{api_base}comics/{book_id}")
     return http_do("POST", url=url)
 
 def episodes(book_id, current_page):
@@ -125,27 +333,27 @@ def episodes(book_id, current_page):
     url = f"{api_base}comics/{book_id}/eps?page={current_page}"
     return http_do("GET", url=url)
 
-#
-def episodes_all(book_id, title: str) -> list:
-    """获取本子的全部章节"""
+def episodes_page(book_id, current_page, version: str = None) -> dict:
+    """获取本子某一页章节（使用响应缓存）"""
+    return cached_get("eps", f"{api_base}comics/{book_id}/eps?page={current_page}", version)
+
+def episodes_all(book_id, title: str, version: str = None) -> list:
+    """获取本子的全部章节，version 为漫画的版本标识（见 comic_version）"""
     try:
-        first_page_data = episodes(book_id, current_page=1).json()
+        first_page_data = episodes_page(book_id, 1, version)
         if 'data' not in first_page_data:
             return []
         # 'total' represents the total number of chapters in the comic,
         # while 'pages' indicates the number of pages needed to paginate the chapter data.
-        total_pages    = first_page_data["data"]["eps"]["pages"]
-        total_episodes = first_page_data["data"]["eps"]["total"]
-        episode_list  = list(first_page_data["data"]["eps"]["docs"])
-        while total_pages > 1:
-            additional_episodes = episodes(book_id, total_pages).json()["data"]["eps"]["docs"]
-            episode_list.extend(list(additional_episodes))
-            total_pages -= 1
+        first_page     = first_page_data["data"]["eps"]
+        total_episodes = first_page["total"]
+        episode_list = paginate(
+            lambda page: episodes_page(book_id, page, version)["data"]["eps"],
+            first_page=first_page
+        )
         episode_list = sorted(episode_list, key=lambda x: x['order'])
         if len(episode_list) != total_episodes:
-            raise Exception('wrong number of episodes,expect:' +
-                total_episodes + ',actual:' + len(episode_list)
-            )
+            raise Exception(f'wrong number of episodes,expect:{total_episodes},actual:{len(episode_list)}')
     except KeyError as e:
         print(f"Comic {title} has been MISSING. KeyError: {e}")
         return []
@@ -154,16 +362,47 @@ def episodes_all(book_id, title: str) -> list:
         return []
     return episode_list
 
+def episodes_since(book_id, title: str, min_order: int, version: str = None) -> list:
+    """
+    增量获取本子中order大于min_order的章节（按order排序）
+    章节列表按order从新到旧分页，逐页获取，某页出现不大于min_order的章节后停止，通常只需请求第1页
+    """
+    episode_list = []
+    current_page = 1
+    try:
+        while True:
+            eps = episodes_page(book_id, current_page, version)["data"]["eps"]
+            newer = [episode for episode in eps["docs"] if episode["order"] > min_order]
+            episode_list.extend(newer)
+            if len(newer) < len(eps["docs"]) or current_page >= eps["pages"]:
+                break
+            current_page += 1
+    except KeyError as e:
+        logger.error(f"Comic {title} has been MISSING. KeyError: {e}")
+        return []
+    except Exception as e:
+        logger.error(f"An error occurred while fetching episodes for comic {title}. Error: {e}")
+        return []
+    return sorted(episode_list, key=lambda x: x['order'])
+
 # 根据章节获取图片
 def picture(book_id, ep_id, page=1):
     url = f"{api_base}comics/{book_id}/order/{ep_id}/pages?page={page}"
     return http_do("GET", url=url)
 
+def picture_page(book_id, ep_id, page=1, version: str = None) -> dict:
+    """获取章节某一页的图片列表（使用响应缓存），返回包含 docs/total/pages 的字典"""
+    url = f"{api_base}comics/{book_id}/order/{ep_id}/pages?page={page}"
+    return cached_get("pages", url, version)["data"]["pages"]
+
+def media_url(media: dict) -> str:
+    """根据图片的media信息拼接下载地址"""
+    return media['fileServer'] + '/static/' + media['path']
+
 # 获取本子详细信息
-def comic_info(book_id):
+def comic_info(book_id, version: str = None):
     url = f"{api_base}comics/{book_id}"
-    res = http_do("GET", url=url)
-    return json.loads(res.content.decode())
+    return cached_get("comic_info", url, version)
 
 def get_categories():
     url = f"{api_base}categories"
@@ -175,6 +414,21 @@ def search(keyword, page=1, sort=Order_Latest):
     res = http_do("POST", url=url, json={"keyword": keyword, "sort": sort})
     return json.loads(res.content.decode("utf-8"))["data"]["comics"]
 
+def search_pages(keyword, max_pages: int, sort=Order_Latest) -> Iterator[dict]:
+    """
+    按页码顺序逐页产出搜索结果的前 max_pages 页（不超过实际总页数）
+    第1页之后每次并发获取 download.page_concurrency 页，
+    调用方停止迭代（如已找到上次下载到的位置）后不再请求后面的页
+    :return: 每页数据（包含 docs/pages 字段）的迭代器
+    """
+    first_page = search(keyword, 1, sort)
+    yield first_page
+    total_pages = min(first_page["pages"], max_pages)
+    window = max(int(get_config(section="download", key="page_concurrency", default_value=4)), 1)
+    for start in range(2, total_pages + 1, window):
+        yield from fetch_pages(lambda page: search(keyword, page, sort),
+                               range(start, min(start + window, total_pages + 1)))
+
 #通过分类获取漫画
 def categories_search(page, categories, sort=Order_Latest):
     """
@@ -202,3 +456,7 @@ def get_old_update(page):
     url = f"{api_base}comics?page={page}&s={sort}"
     res = http_do("GET", url=url)
     return json.loads(res.content.decode("utf-8"))["data"]["comics"]
+
+def get_old_update_pages(pages) -> list:
+    """并发获取从旧到新排序的多页漫画，按页码顺序返回每页数据"""
+    return fetch_pages(get_old_update, pages)
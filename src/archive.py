@@ -0,0 +1,98 @@
+import os
+import struct
+import threading
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Optional
+from util import get_config
+from logger import  logger
+
+# zip本地文件头：签名、版本、标志、压缩方式、时间、日期、CRC、压缩后大小、原大小、文件名长度、扩展字段长度
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+def recover_part(part_path: str) -> int:
+    """
+    找回异常退出（没有写入中央目录）的 .part 中已完整写入的图片
+    按顺序读取本地文件头，数据完整且CRC正确的条目写入新的压缩包，遇到第一个不完整的条目为止
+    :return: 找回的图片数，为0时删除 .part
+    """
+    tmp_path = part_path + ".recover"
+    count = 0
+    with open(part_path, "rb") as f, zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as new:
+        while True:
+            header = f.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                break
+            signature, _, flags, method, _, _, crc, compressed_size, size, name_len, extra_len = \
+                LOCAL_HEADER.unpack(header)
+            # 写入过程中被中断的条目，文件头中的CRC和大小还是占位的0
+            if signature != b"PK\x03\x04" or method != zipfile.ZIP_STORED or compressed_size != size or not size:
+                break
+            name = f.read(name_len).decode("utf-8" if flags & 0x800 else "cp437")
+            f.seek(extra_len, os.SEEK_CUR)
+            data = f.read(size)
+            if len(data) < size or zlib.crc32(data) != crc:
+                break
+            new.writestr(name, data)
+            count += 1
+    if count:
+        os.replace(tmp_path, part_path)
+    else:
+        os.remove(tmp_path)
+        os.remove(part_path)
+    return count
+
+class ChapterArchive:
+    """
+    章节压缩包（download.output_format: cbz）
+
+    图片下载完成后立即以不压缩（ZIP_STORED）方式追加到 <章节>.cbz.part，并删除散落的图片文件；
+    章节全部下载完成后重命名为 <章节>.cbz。zip的中央目录即页码索引，阅读器可以直接按页随机读取。
+    章节未完成时压缩包保持 .part 后缀，下次运行继续追加，已在压缩包中的图片不再下载；
+    上次运行异常退出时 .part 没有中央目录，按本地文件头找回已完整写入的图片（见 recover_part）。
+    """
+    def __init__(self, chapter_path: Path):
+        self.staging_path = Path(chapter_path)
+        self.path = str(self.staging_path) + ".cbz"
+        self.part_path = self.path + ".part"
+        self._lock = threading.Lock()
+        if os.path.exists(self.path) and not os.path.exists(self.part_path):
+            # 已完成的压缩包（数据库中没有记录时）重新打开追加
+            os.replace(self.path, self.part_path)
+        # 追加模式打开非zip文件时不会报错，而是在文件末尾另建压缩包，因此先检查
+        if os.path.exists(self.part_path) and not zipfile.is_zipfile(self.part_path):
+            recovered = recover_part(self.part_path)
+            logger.warning(f"{self.part_path}没有正常关闭，找回{recovered}张图片")
+        self.zip = zipfile.ZipFile(self.part_path, "a", compression=zipfile.ZIP_STORED)
+        self._sizes = {info.filename: info.file_size for info in self.zip.infolist()}
+
+    def size_of(self, name: str) -> Optional[int]:
+        """压缩包中图片的大小，不存在时返回None"""
+        with self._lock:
+            return self._sizes.get(name)
+
+    def add(self, file_path: str, name: str):
+        """把下载好的图片追加到压缩包，并删除原文件"""
+        with self._lock:
+            if name not in self._sizes:
+                self.zip.write(file_path, name)
+                self._sizes[name] = os.path.getsize(file_path)
+        os.remove(file_path)
+
+    def close(self, complete: bool):
+        """关闭压缩包，章节下载完整时去掉 .part 后缀，并删除空的临时目录"""
+        with self._lock:
+            self.zip.close()
+        if complete:
+            os.replace(self.part_path, self.path)
+        try:
+            self.staging_path.rmdir()
+        except OSError:
+            pass
+
+def open_chapter_archive(chapter_path: Path) -> Optional[ChapterArchive]:
+    """按 download.output_format 打开章节压缩包，输出为普通文件夹（folder）时返回None"""
+    if get_config("download", "output_format", "folder") != "cbz":
+        return None
+    return ChapterArchive(chapter_path)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Optional
+from util import get_config
+from logger import  logger
+
+def link_or_copy(src: str, dest: str):
+    """用硬链接把 src 放到 dest（已存在则替换），文件系统不支持硬链接时退回复制"""
+    tmp_path = dest + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+class BlobStore:
+    """
+    按内容寻址的图片仓库（download.blob_store）
+
+    图片按内容的sha1保存为 root/<sha1前两位>/<sha1>，漫画目录中的图片是指向它的硬链接。
+    索引（root/index.db）记录服务器图片路径 media.path → sha1：
+    同一张图片出现在其他漫画、章节中时直接链接，不再下载；
+    路径不同但内容相同的图片也只保留一份。
+    索引与图片保存在同一目录，删除仓库时不会留下失效的记录。
+    输出为压缩包（cbz）时图片已在压缩包中，不再放入仓库，只复用仓库中已有的图片。
+    仓库不随 GitHub Actions 的缓存保留，在CI中只对同一次运行内重复的图片有效。
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.reused_bytes = 0
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            media_path TEXT NOT NULL PRIMARY KEY,
+            sha1 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            create_time TEXT DEFAULT (datetime('now'))
+        )
+        ''')
+        self.conn.commit()
+
+    def blob_path(self, sha1: str) -> str:
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def link_to(self, media_path: str, dest: str) -> Optional[tuple]:
+        """
+        图片已在仓库中时链接到 dest
+        :return: (文件大小, sha1)，仓库中没有该图片时返回None
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT sha1, size FROM blobs WHERE media_path = ?", (media_path,)).fetchone()
+        if row is None:
+            return None
+        sha1, size = row
+        blob = self.blob_path(sha1)
+        if not os.path.exists(blob):
+            return None
+        link_or_copy(blob, dest)
+        with self._lock:
+            self.reused += 1
+            self.reused_bytes += size
+        return size, sha1
+
+    def add(self, media_path: str, path: str, sha1: str, size: int):
+        """
+        把刚下载到 path 的图片放入仓库
+        仓库中已有相同内容时，path 换成指向已有文件的链接，只保留一份
+        """
+        blob = self.blob_path(sha1)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+        except FileExistsError:
+            link_or_copy(blob, path)
+        except OSError:
+            shutil.copyfile(path, blob)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs (media_path, sha1, size) VALUES (?, ?, ?)",
+                (media_path, sha1, size)
+            )
+            self.conn.commit()
+
+    def summary(self) -> str:
+        return f"复用{self.reused}张图片，节省{self.reused_bytes / 1024 / 1024:.1f}MB下载"
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+def get_blob_store() -> Optional[BlobStore]:
+    """获取全局共享的图片仓库，download.blob_store 关闭时返回None"""
+    global _blob_store
+    if _blob_store is None and get_config("download", "blob_store", False):
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = BlobStore(get_config("download", "blob_dir", "./comics/.blobs"))
+    return _blob_store
+
+def close_blob_store():
+    global _blob_store
+    if _blob_store is not None:
+        logger.info(f"图片仓库统计：{_blob_store.summary()}")
+        _blob_store.close()
+        _blob_store = None
+
+def media_path_of(url: str) -> str:
+    """从图片地址中取出服务器上的图片路径（media.path），不同图片服务器上的同一张图片路径相同"""
+    return url.split("/static/", 1)[-1]
@@ -0,0 +1,165 @@
+import json
+import math
+import os
+import threading
+from time import monotonic
+from typing import Optional
+from logger import  logger
+
+class BudgetExhausted(Exception):
+    """剩余时间不足以完成下一个章节，本次运行不再开始新的下载"""
+
+class TimeBudget:
+    """
+    运行时间预算（--time-budget / download.time_budget）
+
+    章节开始下载前，按图片下载速度估算完成在途图片和该章节所需的时间，
+    来不及在截止时间（预算减去预留时间）之前完成时不再开始，已开始的章节继续下载完。
+    下载速度优先使用本次运行的实测值，实测前使用上次运行保存的值（data/throughput.json）；
+    同一文件中还保存了按上次运行结果调整后的分批下载页数（download_plan）。
+    预算为0时不限时间，只统计下载速度。
+    """
+    # 实测多长时间（秒）后改用本次运行的下载速度
+    MIN_MEASURE_SECONDS = 30
+
+    def __init__(self, seconds: float = 0, reserve: float = 0, stats_path: Optional[str] = None):
+        self.seconds = max(seconds, 0)
+        self.start = monotonic()
+        self.deadline = self.start + max(self.seconds - reserve, 0) if self.seconds else None
+        self.stats_path = stats_path
+        self.exhausted = False
+        self.plan = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._fetched = 0
+        self._first_start = None
+        self._stats = {}
+        if stats_path and os.path.exists(stats_path):
+            try:
+                with open(stats_path, encoding="utf-8") as f:
+                    self._stats = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取下载速度记录失败：{e}")
+
+    @property
+    def limited(self) -> bool:
+        return self.deadline is not None
+
+    def remaining(self) -> float:
+        """距离截止时间的秒数，不限时间时为无穷大"""
+        return self.deadline - monotonic() if self.limited else math.inf
+
+    def expired(self) -> bool:
+        return self.limited and self.remaining() <= 0
+
+    def rate(self) -> Optional[float]:
+        """图片下载速度（张/秒），还没有可用的数据时返回None"""
+        with self._lock:
+            return self._rate()
+
+    def _rate(self) -> Optional[float]:
+        if self._first_start is not None and self._fetched:
+            elapsed = monotonic() - self._first_start
+            if elapsed >= self.MIN_MEASURE_SECONDS:
+                return self._fetched / elapsed
+        return self._stats.get("images_per_second")
+
+    @staticmethod
+    def episode_images(comic: dict) -> int:
+        """按漫画的总页数和章节数估算一个章节的图片数，列表中没有这两项时为0"""
+        pages = comic.get("pagesCount") or 0
+        eps = comic.get("epsCount") or 0
+        return math.ceil(pages / eps) if pages > 0 and eps > 0 else 0
+
+    def try_start(self, images: int) -> bool:
+        """
+        准备开始下载一个约有 images 张图片的章节
+        :return: 来得及完成时记为在途并返回True；否则返回False，之后不再开始新的章节
+        """
+        with self._lock:
+            if self.exhausted:
+                return False
+            if self.limited:
+                rate = self._rate()
+                needed = (self._inflight + images) / rate if rate else 0
+                remaining = self.deadline - monotonic()
+                if remaining <= 0 or needed > remaining:
+                    self.exhausted = True
+                    logger.info(f"剩余时间{max(remaining, 0):.0f}秒，预计还需{needed:.0f}秒，不再开始新的章节")
+                    return False
+            if self._first_start is None:
+                self._first_start = monotonic()
+            self._inflight += images
+            return True
+
+    def finish(self, images: int, fetched: int):
+        """
+        章节下载结束
+        :param images: 开始时的估算图片数（与 try_start 相同）
+        :param fetched: 本次实际下载的图片数
+        """
+        with self._lock:
+            self._inflight = max(self._inflight - images, 0)
+            self._fetched += fetched
+
+    def download_plan(self, configured: int) -> int:
+        """
+        本次分批下载的页数：限时运行时使用上次运行调整后的页数，
+        不超过配置值的4倍；配置为0（不分批下载）时始终为0
+        """
+        if configured <= 0 or not self.limited:
+            self.plan = configured
+        else:
+            self.plan = min(max(int(self._stats.get("download_plan", configured)), 1), configured * 4)
+        return self.plan
+
+    def close(self):
+        """保存下载速度和调整后的分批下载页数，供下次运行估算"""
+        with self._lock:
+            rate = self._rate()
+            used = monotonic() - self.start
+        stats = dict(self._stats)
+        if rate:
+            stats["images_per_second"] = round(rate, 3)
+        if self.limited and self.plan:
+            stats["download_plan"] = self._next_plan(used)
+        if not self.stats_path or stats == self._stats:
+            return
+        try:
+            with open(self.stats_path + ".part", "w", encoding="utf-8") as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2)
+            os.replace(self.stats_path + ".part", self.stats_path)
+        except OSError as e:
+            logger.warning(f"保存下载速度记录失败：{e}")
+
+    def _next_plan(self, used: float) -> int:
+        """时间不够用时页数减半；有富余时按用时比例增加（每次最多翻倍），目标是用掉八成的可用时间"""
+        if self.exhausted:
+            return max(self.plan // 2, 1)
+        available = self.deadline - self.start
+        if available <= 0:
+            return self.plan
+        target = round(self.plan * 0.8 * available / max(used, 1))
+        return min(max(target, self.plan), self.plan * 2)
+
+    def summary(self) -> str:
+        rate = self.rate()
+        text = f"用时{monotonic() - self.start:.0f}秒，下载{self._fetched}张图片"
+        if rate:
+            text += f"，{rate:.2f}张/秒"
+        if self.exhausted:
+            text += "，时间预算已用完，剩余的漫画下次运行继续"
+        return text
+
+_time_budget = TimeBudget()
+
+def start_time_budget(minutes: float, reserve_minutes: float, stats_path: str) -> TimeBudget:
+    """开始计时，minutes 为0时不限时间"""
+    global _time_budget
+    _time_budget = TimeBudget(minutes * 60, reserve_minutes * 60, stats_path)
+    if _time_budget.limited:
+        logger.info(f"时间预算{minutes:g}分钟，其中预留{reserve_minutes:g}分钟用于收尾")
+    return _time_budget
+
+def get_time_budget() -> TimeBudget:
+    return _time_budget
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import zlib
+from time import time
+from typing import Optional
+from logger import  logger
+
+class CacheEntry:
+    """一条缓存记录"""
+    __slots__ = ("body", "etag", "last_modified", "version", "stored_at")
+
+    def __init__(self, body: bytes, etag, last_modified, version, stored_at: float):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.version = version
+        self.stored_at = stored_at
+
+class ResponseCache:
+    """
+    元数据接口的磁盘响应缓存（SQLite）
+
+    以请求地址为键保存响应体（zlib压缩），每种接口有各自的有效期（ttls）。
+    记录同时保存漫画的版本标识，版本未变时无论是否过期都直接使用；
+    过期后由调用方携带 ETag/Last-Modified 重新验证。
+    总大小超过 max_bytes 时按最近访问时间淘汰（LRU）。
+    """
+    def __init__(self, db_path: str, ttls: dict, max_bytes: int):
+        self.db_path = db_path
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT NOT NULL PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            body BLOB NOT NULL,
+            etag TEXT DEFAULT NULL,
+            last_modified TEXT DEFAULT NULL,
+            version TEXT DEFAULT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, version, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time(), key))
+            self.conn.commit()
+        body, etag, last_modified, version, stored_at = row
+        return CacheEntry(zlib.decompress(body), etag, last_modified, version, stored_at)
+
+    def is_fresh(self, entry: CacheEntry, endpoint: str, version: Optional[str] = None) -> bool:
+        """版本一致，或仍在该接口的有效期内"""
+        if version is not None and entry.version == version:
+            fresh = True
+        else:
+            fresh = time() - entry.stored_at < self.ttls.get(endpoint, 0)
+        if fresh:
+            with self._lock:
+                self.hits += 1
+        return fresh
+
+    def put(self, key: str, endpoint: str, body: bytes, etag=None, last_modified=None, version=None):
+        data = zlib.compress(body)
+        now = time()
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute('''
+            INSERT OR REPLACE INTO responses
+            (key, endpoint, body, etag, last_modified, version, size, stored_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (key, endpoint, data, etag, last_modified, version, len(data), now, now))
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def refresh(self, key: str, version=None):
+        """服务器返回304时，刷新记录的保存时间"""
+        with self._lock:
+            self.revalidated += 1
+            self.conn.execute(
+                "UPDATE responses SET stored_at = ?, version = COALESCE(?, version) WHERE key = ?",
+                (time(), version, key)
+            )
+            self.conn.commit()
+
+    def invalidate(self, key: str):
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.total_bytes -= old[0]
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小降到上限的90%以下"""
+        target = self.max_bytes * 0.9
+        removed = 0
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self.total_bytes -= sum(size for _, size in rows)
+            removed += len(rows)
+        logger.info(f"响应缓存超过上限，淘汰{removed}条记录")
+
+    def summary(self) -> str:
+        size_mb = self.total_bytes / 1024 / 1024
+        return f"命中:{self.hits} 未命中或过期:{self.misses} 304重新验证:{self.revalidated} 占用:{size_mb:.1f}MB"
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,22 +1,70 @@
+import atexit
 import json
 import os
+import queue
 import sqlite3
+import threading
+from time import monotonic
+from functools import partial, wraps
 from datetime import datetime
 from typing import List, Dict, Optional
+from metrics import metrics
 from logger import  logger
 
+def synchronized(method):
+    """读操作共用一个连接和游标，方法执行期间加锁，避免多线程操作交错；耗时（含等锁）计入 db_call_seconds"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with metrics.timer("db_call_seconds", method=method.__name__), self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# 写线程的结束标记
+_STOP = object()
+
 class ComicSQLiteDB:
-    """SQLite漫画数据库操作类"""
-    def __init__(self, db_path: str = "./data/comic_spider.db"):
+    """
+    SQLite漫画数据库操作类
+
+    写操作采用write-behind：调用方只把SQL放入队列，由专门的写线程用自己的连接执行，
+    每满 batch_size 条或距本批第一条超过 flush_interval 秒提交一次事务。
+    读操作在调用线程中执行，只能读到已提交的数据，需要读到自己刚写入的数据时先调用 flush()。
+    执行或提交失败而没有保存的写操作计入 dropped_writes，flush() 发现有新的失败时抛出异常，close() 时汇总记录。
+
+    漫画ID、标题、更新时间、章节数和已下载章节在启动时载入内存索引，
+    is_comic_downloaded、get_sync_state 等下载过程中频繁调用的查询直接读索引，不访问SQLite。
+    索引由写线程在写操作提交成功后更新（见 _enqueue 的 on_commit），写入失败时保持不变，与数据库一致。
+    """
+    def __init__(self, db_path: str = "./data/comic_spider.db",
+                 flush_interval: float = 1.0, batch_size: int = 200):
         self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = max(batch_size, 1)
         db_dir = os.path.dirname(self.db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)  # exist_ok=True 避免重复创建报错
             logger.info(f"✅ 自动创建文件夹：{db_dir}")
         self.conn: sqlite3.Connection = None
         self.cursor: sqlite3.Cursor = None
+        self._lock = threading.RLock()
+        self._closed = False
+        # 没有保存的写操作数，以及上次 flush() 之后的失败原因
+        self.dropped_writes = 0
+        self._write_errors = []
+        self._error_lock = threading.Lock()
         self._connect()
         self._init_table()
+        # 内存索引：comic_id → (title, update_time, epsCount)；comic_id → {已下载章节标题: 序号}
+        self._index_lock = threading.Lock()
+        self._comics: Dict[str, tuple] = {}
+        self._episodes: Dict[str, Dict[str, Optional[int]]] = {}
+        self._load_index()
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        metrics.register_gauge("db_write_queue", self._writes.qsize)
+        # 程序退出时把队列中剩余的写操作提交
+        atexit.register(self.close)
 
     def _connect(self):
         """连接数据库（自动创建文件）"""
@@ -31,6 +79,101 @@ class ComicSQLiteDB:
             self.conn.execute("PRAGMA journal_mode = WAL")  # 读写并发
         except sqlite3.Error as e:
             raise Exception(f"数据库连接失败：{e}")
+    def _write_loop(self):
+        """写线程：按批次在同一个事务中执行队列中的写操作"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA synchronous = OFF")
+        pending = 0
+        waiters = []
+        # 本批次执行成功的写操作数，及其对应的索引更新（提交成功后执行）
+        executed = 0
+        committed = []
+        batch_start = 0.0
+        while True:
+            timeout = None if pending == 0 else max(0.0, batch_start + self.flush_interval - monotonic())
+            try:
+                item = self._writes.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # 距本批第一条已超过 flush_interval，提交
+            if isinstance(item, tuple):
+                sql, params, many, on_commit = item
+                try:
+                    if many:
+                        conn.executemany(sql, params)
+                    else:
+                        conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    # 出错只回滚当前语句，同一批次的其他写操作照常提交
+                    logger.error(f"数据库写入失败：{e} | SQL：{sql.strip()} | 参数：{params}")
+                    self._record_dropped(1, e)
+                else:
+                    executed += 1
+                    if on_commit is not None:
+                        committed.append(on_commit)
+                if pending == 0:
+                    batch_start = monotonic()
+                pending += 1
+                if pending < self.batch_size:
+                    continue
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            if pending:
+                start = monotonic()
+                try:
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"数据库提交失败，本批次{executed}条写操作没有保存：{e}")
+                    conn.rollback()
+                    self._record_dropped(executed, e)
+                else:
+                    with self._index_lock:
+                        for on_commit in committed:
+                            on_commit()
+                committed.clear()
+                executed = 0
+                metrics.observe("db_commit_seconds", monotonic() - start)
+                metrics.inc("db_writes_total", pending)
+                pending = 0
+            for waiter in waiters:
+                waiter.set()
+            waiters.clear()
+            if item is _STOP:
+                break
+        conn.close()
+
+    def _enqueue(self, sql: str, params, many: bool = False, on_commit=None):
+        """
+        把写操作放入队列，由写线程执行
+        :param on_commit: 写操作提交成功后在写线程中调用（持有索引锁），用于更新内存索引
+        """
+        if self._closed:
+            raise Exception("数据库已关闭")
+        self._writes.put((sql, params, many, on_commit))
+
+    def _record_dropped(self, count: int, error: Exception):
+        """写线程中记录没有保存的写操作"""
+        if not count:
+            return
+        metrics.inc("db_write_errors_total", count)
+        with self._error_lock:
+            self.dropped_writes += count
+            self._write_errors.append((count, error))
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        等待队列中已有的写操作全部提交
+        上次 flush() 之后有写操作执行或提交失败时抛出异常，调用方可据此判断数据是否已保存
+        """
+        if not self._closed and self._writer.is_alive():
+            done = threading.Event()
+            self._writes.put(done)
+            done.wait(timeout)
+        with self._error_lock:
+            errors, self._write_errors = self._write_errors, []
+        if errors:
+            raise Exception(f"有{sum(count for count, _ in errors)}条写操作没有保存到数据库，"
+                            f"最近一次错误：{errors[-1][1]}")
+
     def _init_table(self):
         """初始化表结构（不存在则创建）"""
         create_sql = '''
@@ -48,12 +191,41 @@ class ComicSQLiteDB:
             CONSTRAINT idx_comic_title UNIQUE (title, author)
         )
         '''
+        # 图片级下载记录：每章节每张图片一行，章节图片列表获取完整后一次性写入
+        create_images_sql = '''
+        CREATE TABLE IF NOT EXISTS images (
+            comic_id TEXT NOT NULL,
+            ep_order INTEGER NOT NULL,
+            page_index INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            size INTEGER DEFAULT NULL,
+            status TEXT DEFAULT 'pending',
+            hash TEXT DEFAULT NULL,
+            update_time TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (comic_id, ep_order, page_index)
+        )
+        '''
+        # 已下载章节：每章节一行，取代 comic_info.downloaded_episodes 中的JSON列表
+        # 旧数据只有章节标题，因此以 (comic_id, title) 为主键，章节ID和序号可为空
+        create_episodes_sql = '''
+        CREATE TABLE IF NOT EXISTS episodes (
+            comic_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            ep_id TEXT DEFAULT NULL,
+            ep_order INTEGER DEFAULT NULL,
+            download_time TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (comic_id, title)
+        )
+        '''
         create_index_sqls = [
             "CREATE INDEX IF NOT EXISTS idx_comic_category ON comic_info(category)",
-            "CREATE INDEX IF NOT EXISTS idx_comic_update_time ON comic_info(update_time)"
+            "CREATE INDEX IF NOT EXISTS idx_comic_update_time ON comic_info(update_time)",
+            "CREATE INDEX IF NOT EXISTS idx_episodes_order ON episodes(comic_id, ep_order)"
         ]
         try:
             self.cursor.execute(create_sql)
+            self.cursor.execute(create_images_sql)
+            self.cursor.execute(create_episodes_sql)
             # 执行建索引
             for sql in create_index_sqls:
                 self.cursor.execute(sql)
@@ -63,6 +235,68 @@ class ComicSQLiteDB:
             self.conn.rollback()
             logger.error(f"表或索引初始化失败：{e}")
             raise Exception(f"表初始化失败：{e}")
+        self._migrate()
+
+    def _migrate(self):
+        """按 PRAGMA user_version 记录的版本升级旧数据"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # 版本1：把 comic_info.downloaded_episodes 的JSON列表迁移到 episodes 表
+            try:
+                rows = self.conn.execute(
+                    "SELECT comic_id, downloaded_episodes FROM comic_info "
+                    "WHERE downloaded_episodes IS NOT NULL AND downloaded_episodes != ''"
+                ).fetchall()
+                episodes = []
+                for comic_id, downloaded_episodes in rows:
+                    for title in json.loads(downloaded_episodes):
+                        episodes.append((comic_id, title))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO episodes (comic_id, title) VALUES (?, ?)", episodes
+                )
+                self.conn.execute("PRAGMA user_version = 1")
+                self.conn.commit()
+                logger.info(f"已迁移{len(rows)}本漫画的{len(episodes)}个已下载章节到episodes表")
+            except (sqlite3.Error, ValueError) as e:
+                self.conn.rollback()
+                raise Exception(f"数据库升级失败：{e}")
+        if version < 2:
+            # 版本2：images 表记录重新压缩后的大小和格式（原始大小仍在 size 列）
+            try:
+                self.conn.execute("ALTER TABLE images ADD COLUMN processed_size INTEGER DEFAULT NULL")
+                self.conn.execute("ALTER TABLE images ADD COLUMN processed_format TEXT DEFAULT NULL")
+                self.conn.execute("PRAGMA user_version = 2")
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                raise Exception(f"数据库升级失败：{e}")
+        if version < 3:
+            # 版本3：episodes 表按章节记录重新压缩前后的总大小和格式，不开启 image_ledger 时也有记录
+            try:
+                self.conn.execute("ALTER TABLE episodes ADD COLUMN original_size INTEGER DEFAULT NULL")
+                self.conn.execute("ALTER TABLE episodes ADD COLUMN processed_size INTEGER DEFAULT NULL")
+                self.conn.execute("ALTER TABLE episodes ADD COLUMN processed_format TEXT DEFAULT NULL")
+                self.conn.execute("PRAGMA user_version = 3")
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                raise Exception(f"数据库升级失败：{e}")
+
+    def _load_index(self):
+        """从数据库载入内存索引（写线程启动前调用，此时数据都已提交）"""
+        start = monotonic()
+        try:
+            for comic_id, title, update_time, eps_count in self.conn.execute(
+                    "SELECT comic_id, title, update_time, epsCount FROM comic_info"):
+                self._comics[comic_id] = (title, update_time, eps_count)
+            for comic_id, title, ep_order in self.conn.execute(
+                    "SELECT comic_id, title, ep_order FROM episodes"):
+                self._episodes.setdefault(comic_id, {})[title] = ep_order
+        except sqlite3.Error as e:
+            raise Exception(f"载入漫画索引失败：{e}")
+        logger.info(f"已载入{len(self._comics)}本漫画、"
+                    f"{sum(len(episodes) for episodes in self._episodes.values())}个已下载章节的索引，"
+                    f"用时{monotonic() - start:.2f}秒")
 
     def save_comic(self, comic_data: Dict):
         """
@@ -95,14 +329,13 @@ class ComicSQLiteDB:
         VALUES ({placeholders})
         ON CONFLICT(comic_id) DO UPDATE SET {update_clause}
         '''
-        try:
-            self.cursor.execute(sql, tuple(filtered_data.values()))
-            self.conn.commit()
-            logger.info(f"保存成功：{filtered_data.get('title', '未知标题')}")
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise Exception(f"保存失败：{e} | 数据：{filtered_data}")
+        self._enqueue(sql, tuple(filtered_data.values()), on_commit=partial(
+            self._comics.__setitem__, filtered_data["comic_id"],
+            (filtered_data["title"], filtered_data["update_time"], filtered_data["epsCount"])
+        ))
+        logger.debug("保存成功：%s", filtered_data.get('title', '未知标题'))
 
+    @synchronized
     def get_comic(self,
                   comic_id: Optional[str] = None,
                   title: Optional[str] = None,
@@ -144,6 +377,7 @@ class ComicSQLiteDB:
         except sqlite3.Error as e:
             raise Exception(f"查询失败：{e}")
 
+    @synchronized
     def delete_comic(self, comic_id: str) -> bool:
         """
         根据ID删除漫画数据
@@ -151,9 +385,13 @@ class ComicSQLiteDB:
         :return: 是否删除成功
         """
         sql = "DELETE FROM comic_info WHERE comic_id = ?"
+        # 删除需要返回结果，先等待队列中的写操作提交，再同步执行
+        self.flush()
         try:
             self.cursor.execute(sql, (comic_id,))
             self.conn.commit()
+            with self._index_lock:
+                self._comics.pop(comic_id, None)
             if self.cursor.rowcount > 0:
                 logger.info(f"删除成功：{comic_id}")
                 return True
@@ -165,12 +403,21 @@ class ComicSQLiteDB:
             raise Exception(f"删除失败：{e}")
 
     def close(self):
-        """关闭数据库连接"""
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
-        logger.info("数据库连接已关闭")
+        """提交队列中剩余的写操作，并关闭数据库连接"""
+        with self._lock:
+            if self._closed:
+                return
+            if getattr(self, "_writer", None) is not None and self._writer.is_alive():
+                self._writes.put(_STOP)
+                self._writer.join()
+            self._closed = True
+            if self.cursor:
+                self.cursor.close()
+            if self.conn:
+                self.conn.close()
+            if self.dropped_writes:
+                logger.error(f"本次运行共有{self.dropped_writes}条写操作没有保存到数据库，详见上方的写入失败日志")
+            logger.info("数据库连接已关闭")
 
     def __del__(self):
         """析构函数：自动关闭连接"""
@@ -180,69 +427,96 @@ class ComicSQLiteDB:
         """
         获取已下载漫画的数量。
         """
-        self.cursor.execute('SELECT COUNT(*) FROM comic_info')
-        count = self.cursor.fetchone()[0]
-        return count
+        with self._index_lock:
+            return len(self._comics)
 
     def is_comic_downloaded(self,cid):
         """
         检查漫画 ID 是否已经下载过。
         """
-        self.cursor.execute('SELECT 1 FROM comic_info WHERE comic_id = ?', (cid,))
-        result = self.cursor.fetchone()
-        return result is not None
+        with self._index_lock:
+            return cid in self._comics
 
     def is_episode_downloaded(self,comic_id,episode_title):
         """
         判断漫画的指定章节是否已下载。
         """
-        self.cursor.execute('SELECT downloaded_episodes FROM comic_info WHERE comic_id = ?', (comic_id,))
-        result = self.cursor.fetchone()
-        if result and result[0]:
-            downloaded_episodes = json.loads(result[0])
-            logger.info(f"查询数据库中是否已存在{episode_title}")
-            return episode_title in downloaded_episodes
-        return False
+        with self._index_lock:
+            return episode_title in self._episodes.get(comic_id, {})
+
+    def get_downloaded_episodes(self, comic_id) -> set:
+        """
+        漫画全部已下载章节的标题
+        :return: 章节标题集合
+        """
+        with self._index_lock:
+            return set(self._episodes.get(comic_id, {}))
+
+    def get_sync_state(self, comic_id) -> Optional[Dict]:
+        """
+        查询增量同步所需的漫画状态（未记录该漫画时返回None）
+        :return: {update_time, epsCount, episode_count 已下载章节数,
+                  ordered_count 记录了序号的已下载章节数, max_order 已下载章节的最大序号}
+        """
+        with self._index_lock:
+            comic = self._comics.get(comic_id)
+            if comic is None:
+                return None
+            orders = [order for order in self._episodes.get(comic_id, {}).values() if order is not None]
+            episode_count = len(self._episodes.get(comic_id, {}))
+        _, update_time, eps_count = comic
+        return {
+            "update_time": update_time,
+            "epsCount": eps_count or 0,
+            "episode_count": episode_count,
+            "ordered_count": len(orders),
+            "max_order": max(orders) if orders else None,
+        }
+
+    def backfill_episode_orders(self, comic_id, episodes: List[Dict]):
+        """为旧数据迁移来的已下载章节补全章节ID和序号（已有序号的不变）"""
+        if not episodes:
+            return
+        self._enqueue(
+            "UPDATE episodes SET ep_id = ?, ep_order = ? "
+            "WHERE comic_id = ? AND title = ? AND ep_order IS NULL",
+            [(episode.get("_id"), episode["order"], comic_id, episode["title"]) for episode in episodes],
+            many=True,
+            on_commit=partial(self._index_backfill, comic_id, [(episode["title"], episode["order"])
+                                                               for episode in episodes])
+        )
+
+    def _index_backfill(self, comic_id, orders: List[tuple]):
+        downloaded = self._episodes.get(comic_id, {})
+        for title, order in orders:
+            if title in downloaded and downloaded[title] is None:
+                downloaded[title] = order
 
     def mark_comic_as_downloaded(self,comic_id):
         """
-        标记漫画为已下载，在数据库中插入该 comic_id。
+        标记漫画为已下载，在数据库中插入该 comic_id（已存在则忽略）。
         """
-        self.cursor.execute('SELECT comic_id FROM comic_info WHERE comic_id = ?', (comic_id,))
-        result = self.cursor.fetchone()
-        if not result:
-            self.cursor.execute('INSERT OR IGNORE INTO comic_info (comic_id) VALUES (?)', (comic_id,))
-            logger.info("第一次下载该漫画，记录数据库中")
-            self.conn.commit()
+        self._enqueue('INSERT OR IGNORE INTO comic_info (comic_id) VALUES (?)', (comic_id,),
+                      on_commit=partial(self._comics.setdefault, comic_id, (None, None, 0)))
 
-    def update_downloaded_episodes(self,comic_id,episode_title):
+    def update_downloaded_episodes(self,comic_id,episode_title,ep_id=None,ep_order=None):
         """
-        更新数据库中的已下载章节列表。
+        记录已下载章节。
         """
-        #获取已经下载的章节
-        self.cursor.execute('SELECT downloaded_episodes FROM comic_info WHERE comic_id = ?', (comic_id,))
-        result = self.cursor.fetchone()
-        # 如果该漫画已存在，获取已下载章节列表
-        if result and result[0]:
-            downloaded_episodes = json.loads(result[0])
-        else:
-            downloaded_episodes = []
-        downloaded_episodes.append(episode_title)
-        # 更新数据库中的章节列表
-        self.cursor.execute('''
-            UPDATE comic_info 
-            SET downloaded_episodes = ? 
-            WHERE comic_id = ?
-            ''', (json.dumps(downloaded_episodes), comic_id))
-        self.conn.commit()
-        logger.info("数据库更新已下载章节")
-        #从数据库里获取章节列表打印出来
-        self.cursor.execute('SELECT downloaded_episodes FROM comic_info WHERE comic_id = ?', (comic_id,))
-        result = self.cursor.fetchone()
-        if result and result[0]:
-            downloaded_episodes = json.loads(result[0])
-            logger.info("该漫画已下载章节如下")
-            logger.info(downloaded_episodes)
+        self._enqueue('''
+            INSERT INTO episodes (comic_id, title, ep_id, ep_order)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(comic_id, title) DO UPDATE SET
+                ep_id = COALESCE(excluded.ep_id, ep_id),
+                ep_order = COALESCE(excluded.ep_order, ep_order)
+            ''', (comic_id, episode_title, ep_id, ep_order),
+            on_commit=partial(self._index_episode, comic_id, episode_title, ep_order))
+        logger.debug("数据库更新已下载章节：%s", episode_title)
+
+    def _index_episode(self, comic_id, episode_title, ep_order):
+        downloaded = self._episodes.setdefault(comic_id, {})
+        if ep_order is not None or episode_title not in downloaded:
+            downloaded[episode_title] = ep_order
 
     def get_title_by_comic_id(self, comic_id: str) -> Optional[str]:
         """
@@ -250,19 +524,15 @@ class ComicSQLiteDB:
         :param comic_id: 漫画唯一ID
         :return: 漫画标题，如果未找到则返回None
         """
-        sql = "SELECT title FROM comic_info WHERE comic_id = ?"
-        try:
-            self.cursor.execute(sql, (comic_id,))
-            result = self.cursor.fetchone()
-            if result:
-                logger.info(f"根据ID查询到标题：{comic_id} -> {result[0]}")
-                return result[0]
-            else:
-                logger.info(f"未找到ID为{comic_id}的漫画标题")
-                return None
-        except sqlite3.Error as e:
-            raise Exception(f"查询失败：{e}")
+        with self._index_lock:
+            comic = self._comics.get(comic_id)
+        if comic is None:
+            logger.debug("未找到ID为%s的漫画标题", comic_id)
+            return None
+        logger.debug("根据ID查询到标题：%s -> %s", comic_id, comic[0])
+        return comic[0]
 
+    @synchronized
     def create_download_all_info(self):
         """初始化表结构（不存在则创建）"""
         create_sql = '''
@@ -274,6 +544,8 @@ class ComicSQLiteDB:
             crawl_time TEXT DEFAULT (datetime('now'))
         )
         '''
+        # 建表与写线程的事务互不等待
+        self.flush()
         try:
             self.cursor.execute(create_sql)
             self.conn.commit()
@@ -312,15 +584,16 @@ class ComicSQLiteDB:
         VALUES ({placeholders})
         ON CONFLICT(comic_id) DO UPDATE SET {update_clause}
         '''
-        try:
-            self.cursor.execute(sql, tuple(filtered_data.values()))
-            self.conn.commit()
-            logger.info(f"保存成功")
-        except sqlite3.Error as e:
-            self.conn.rollback()
-            raise Exception(f"保存失败：{e} | 数据：{filtered_data}")
+        self._enqueue(sql, tuple(filtered_data.values()))
+        logger.info(f"保存成功")
 
     def get_download_info_pagesCount(self, comic_id: str):
+        # 通常紧跟在 mark_download_info_id 之后调用，先等待写入提交
+        self.flush()
+        return self._get_download_info_pagesCount(comic_id)
+
+    @synchronized
+    def _get_download_info_pagesCount(self, comic_id: str):
         sql = "SELECT pagesCount FROM download_info WHERE comic_id = ?"
         try:
             self.cursor.execute(sql, (comic_id,))
@@ -333,9 +606,67 @@ class ComicSQLiteDB:
             raise Exception(f"查询失败：{e}")
 
     def mark_download_info_id(self,comic_id):
-        self.cursor.execute('SELECT comic_id FROM download_info WHERE comic_id = ?', (comic_id,))
-        result = self.cursor.fetchone()
-        if not result:
-            self.cursor.execute('INSERT OR IGNORE INTO download_info (comic_id) VALUES (?)', (comic_id,))
-            logger.info("第一次下载全部漫画，记录数据库中")
-            self.conn.commit()
+        self._enqueue('INSERT OR IGNORE INTO download_info (comic_id) VALUES (?)', (comic_id,))
+
+    def save_episode_images(self, comic_id, ep_order, urls: List[str]):
+        """
+        批量写入章节的图片列表（状态为pending），已有记录只更新地址
+        :param comic_id: 漫画ID
+        :param ep_order: 章节序号
+        :param urls: 按页码排序的图片地址
+        """
+        sql = '''
+        INSERT INTO images (comic_id, ep_order, page_index, url)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(comic_id, ep_order, page_index) DO UPDATE SET url = excluded.url
+        '''
+        self._enqueue(sql, [(comic_id, ep_order, index, url) for index, url in enumerate(urls)], many=True)
+
+    def update_episode_processed(self, comic_id, episode_title, fmt: str, original_size: int,
+                                 processed_size: int):
+        """记录章节重新压缩前后的总大小（episodes 表，与 image_ledger 无关）"""
+        self._enqueue(
+            "UPDATE episodes SET original_size = ?, processed_size = ?, processed_format = ? "
+            "WHERE comic_id = ? AND title = ?",
+            (original_size, processed_size, fmt, comic_id, episode_title)
+        )
+
+    def update_processed_sizes(self, comic_id, ep_order, fmt: str, results: List[tuple]):
+        """
+        记录章节每张图片重新压缩后的大小（images 表，需开启 image_ledger）
+        :param results: [(图片序号, 处理后大小)]
+        """
+        self._enqueue(
+            "UPDATE images SET processed_size = ?, processed_format = ? "
+            "WHERE comic_id = ? AND ep_order = ? AND page_index = ?",
+            [(size, fmt, comic_id, ep_order, page_index) for page_index, size in results],
+            many=True
+        )
+
+    @synchronized
+    def get_episode_images(self, comic_id, ep_order) -> List[Dict]:
+        """
+        查询章节的图片下载记录
+        :return: 按页码排序的字典列表（page_index/url/size/status/hash），没有记录时为空列表
+        """
+        self.cursor.execute('''
+            SELECT page_index, url, size, status, hash FROM images
+            WHERE comic_id = ? AND ep_order = ? ORDER BY page_index
+            ''', (comic_id, ep_order))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def update_images_status(self, comic_id, ep_order, results: List[tuple]):
+        """
+        批量更新图片下载状态
+        :param results: [(page_index, status, size, hash)]，size/hash 为None时保留原值
+        """
+        sql = '''
+        UPDATE images
+        SET status = ?, size = COALESCE(?, size), hash = COALESCE(?, hash), update_time = datetime('now')
+        WHERE comic_id = ? AND ep_order = ? AND page_index = ?
+        '''
+        self._enqueue(sql, [
+            (status, size, file_hash, comic_id, ep_order, page_index)
+            for page_index, status, size, file_hash in results
+        ], many=True)
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import requests
+from time import sleep, monotonic
+from urllib.parse import urlparse
+from api import http_do
+from ratelimit import retry_delay
+from blobstore import get_blob_store, media_path_of
+from metrics import metrics
+from logger import  logger
+
+def save_response_stream(response, path: str, chunk_size: int = 64 * 1024) -> tuple:
+    """
+    流式写入图片：边接收边写入临时文件，下载完整后再原子重命名为目标文件。
+    :param response: stream=True 发起请求得到的响应
+    :param path: 最终保存路径
+    :param chunk_size: 每次写入的块大小
+    :return: (写入的字节数, 内容的sha1)
+    """
+    tmp_path = path + ".part"
+    written = 0
+    sha1 = hashlib.sha1()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    sha1.update(chunk)
+                    written += len(chunk)
+        expected = response.headers.get("Content-Length")
+        # 有压缩编码时 Content-Length 是压缩后的长度，无法直接比较
+        if expected is not None and not response.headers.get("Content-Encoding"):
+            if int(expected) != written:
+                raise IOError(f"图片不完整，期望{expected}字节，实际{written}字节")
+        os.replace(tmp_path, path)
+        return written, sha1.hexdigest()
+    except BaseException as e:
+        slot = getattr(response, "limiter_slot", None)
+        if slot is not None and isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                                                requests.exceptions.ChunkedEncodingError)):
+            # 读取正文超时或连接中断，同样反馈给主机的限流器
+            slot.release(congested=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        response.close()
+
+def download(name_len,folder_path: str, i: int, url: str, retries=3, stream=False, archive=None):
+    """
+    下载单张图片，失败时按带抖动的指数退避重试，共尝试 retries 次。
+    每次尝试只发送一次请求（http_do 不再内部重试），
+    失败结果会反馈给主机的自适应限流器。
+    开启图片仓库（见 blobstore.BlobStore）时，已下载过的同一张图片直接链接，不再请求。
+    :param archive: 章节压缩包（见 archive.ChapterArchive），图片下载完成后追加进去
+    :return: (文件大小, 内容的sha1)，文件已存在时sha1为None
+    """
+    name = str(i + 1).zfill(name_len) + '.jpg'
+    path = os.path.join(folder_path, name)
+    if archive is None:
+        return download_file(path, url, retries, stream)
+    size = archive.size_of(name)
+    if size is not None:
+        return size, None
+    # 压缩包中已有一份图片，不再放入图片仓库
+    result = download_file(path, url, retries, stream, keep_blob=False)
+    archive.add(path, name)
+    return result
+
+def download_file(path: str, url: str, retries=3, stream=False, keep_blob=True):
+    """
+    下载单张图片到 path，参数与返回值同 download
+    :param keep_blob: 是否把下载的图片放入图片仓库（仓库中已有的图片总是直接链接）
+    """
+    store = get_blob_store()
+    media_path = media_path_of(url)
+    host = urlparse(url).netloc
+    start = monotonic()
+    for attempt in range(retries):
+        response = None
+        try:
+            if os.path.exists(path):
+                metrics.inc("images_total", result="exists")
+                return os.path.getsize(path), None
+            if store is not None:
+                linked = store.link_to(media_path, path)
+                if linked is not None:
+                    metrics.inc("images_total", result="linked")
+                    return linked
+            response = http_do("GET", url=url, retries=0, stream=stream)
+            if response.status_code == 200:
+                if stream:
+                    size, sha1 = save_response_stream(response, path)
+                else:
+                    content = response.content
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                    size, sha1 = len(content), hashlib.sha1(content).hexdigest()
+                if store is not None and keep_blob:
+                    store.add(media_path, path, sha1, size)
+                metrics.observe("download_seconds", monotonic() - start, host=host)
+                metrics.inc("download_bytes_total", size, host=host)
+                metrics.inc("images_total", result="downloaded")
+                return size, sha1
+            else:
+                response.close()
+                logger.warning("Attempt %d failed for %s, status code: %s", attempt + 1, url, response.status_code)
+        except requests.exceptions.Timeout:
+            logger.error("Attempt %d timeout for %s", attempt + 1, url)
+        except Exception as e:
+            logger.error("Attempt %d error for %s: %s", attempt + 1, url, e)
+        if attempt < retries - 1:
+            metrics.inc("download_retries_total", host=host)
+            sleep(retry_delay(response, attempt))
+    metrics.inc("images_total", result="failed")
+    raise Exception(f"Failed to download {url} after {retries} attempts.")
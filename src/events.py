@@ -0,0 +1,76 @@
+import atexit
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from util import get_config
+from logger import  logger
+
+# 写线程的结束标记
+_STOP = object()
+
+class EventLog:
+    """
+    结构化事件日志（JSON Lines），与文本日志放在同一目录：logs/events_<日期>.jsonl
+
+    每行一个事件，包含 ts（时间）、event（事件类型）以及 comic_id、episode、bytes、duration、status 等字段。
+    调用方只把事件放入队列，由后台线程序列化并写入文件，按事件日期切换文件。
+    统计分析见 log_stats.py。
+    """
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        self._events = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="event-writer", daemon=True)
+        self._writer.start()
+
+    def emit(self, event: str, **fields):
+        self._events.put({"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event, **fields})
+
+    def _write_loop(self):
+        day, f = None, None
+        while True:
+            item = self._events.get()
+            if item is _STOP:
+                break
+            try:
+                if item["ts"][:10] != day:
+                    if f is not None:
+                        f.close()
+                    day = item["ts"][:10]
+                    f = open(os.path.join(self.log_dir, f"events_{day}.jsonl"), "a", encoding="utf-8")
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+                # 队列暂时空了再刷新，连续的事件一次写入
+                if self._events.empty():
+                    f.flush()
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning("写入事件日志失败：%s", e)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        """写完队列中剩余的事件"""
+        if self._writer.is_alive():
+            self._events.put(_STOP)
+            self._writer.join()
+
+_event_log = None
+
+def start_event_log():
+    """logging.events 开启时开始记录事件日志（写入 logging.events_dir，默认与文本日志相同的 ./logs）"""
+    global _event_log
+    if _event_log is None and get_config("logging", "events", False):
+        _event_log = EventLog(get_config("logging", "events_dir", "./logs"))
+        atexit.register(close_event_log)
+
+def emit_event(event: str, **fields):
+    """记录一个事件，没有开启事件日志时直接返回"""
+    if _event_log is not None:
+        _event_log.emit(event, **fields)
+
+def close_event_log():
+    global _event_log
+    if _event_log is not None:
+        _event_log.close()
+        _event_log = None
@@ -0,0 +1,101 @@
+import io
+import os
+import zipfile
+from typing import List, Optional, Tuple
+from pdf import export_chapter_pdf
+
+# 本模块在进程池的子进程中执行，只依赖标准库和可选的Pillow
+
+# 重新压缩的格式 → (文件扩展名, Pillow格式名)
+FORMATS = {
+    "webp": (".webp", "WEBP"),
+    "avif": (".avif", "AVIF"),
+    "jpeg": (".jpg", "JPEG"),
+}
+
+def recompress(data: bytes, fmt: str, quality: int, max_width: int = 0) -> bytes:
+    """把图片重新压缩为 fmt 格式，宽度超过 max_width 时等比缩小（0为不缩放）"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        if max_width and image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        if image.mode not in ("RGB", "L") and fmt == "jpeg":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, FORMATS[fmt][1], quality=quality)
+        return output.getvalue()
+
+def recompress_chapter(source: str, fmt: str, quality: int, max_width: int = 0) -> List[Tuple[int, int, int]]:
+    """
+    重新压缩章节中的全部图片，source 为章节文件夹或 .cbz 压缩包
+    压缩后反而变大的图片保留原文件
+    :return: [(图片序号, 处理前大小, 处理后大小)]，序号由文件名（001.jpg → 0）得出
+    """
+    extension = FORMATS[fmt][0]
+    results = []
+    if zipfile.is_zipfile(source):
+        tmp_path = source + ".part"
+        try:
+            with zipfile.ZipFile(source) as old, \
+                    zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as new:
+                for name in sorted(old.namelist()):
+                    data = old.read(name)
+                    stem = os.path.splitext(name)[0]
+                    output = _recompress_or_none(data, fmt, quality, max_width)
+                    if output is None:
+                        new.writestr(name, data)
+                        output = data
+                    else:
+                        new.writestr(stem + extension, output)
+                    results.append((_page_index(stem), len(data), len(output)))
+            os.replace(tmp_path, source)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return results
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        stem, old_extension = os.path.splitext(name)
+        if not os.path.isfile(path) or old_extension == ".part":
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        output = _recompress_or_none(data, fmt, quality, max_width)
+        if output is None:
+            results.append((_page_index(stem), len(data), len(data)))
+            continue
+        new_path = os.path.join(source, stem + extension)
+        with open(new_path + ".part", "wb") as f:
+            f.write(output)
+        os.replace(new_path + ".part", new_path)
+        if new_path != path:
+            os.remove(path)
+        results.append((_page_index(stem), len(data), len(output)))
+    return results
+
+def _recompress_or_none(data: bytes, fmt: str, quality: int, max_width: int) -> Optional[bytes]:
+    """重新压缩失败（无法识别的图片）或压缩后没有变小时返回None"""
+    try:
+        output = recompress(data, fmt, quality, max_width)
+    except OSError:
+        return None
+    return output if len(output) < len(data) else None
+
+def _page_index(stem: str) -> int:
+    return int(stem) - 1 if stem.isdigit() else -1
+
+def process_chapter(source: str, pdf_path: Optional[str], password: Optional[str],
+                    options: Optional[Tuple[str, int, int]]) -> dict:
+    """
+    章节的全部后处理：先用原图生成PDF，再重新压缩图片
+    :param pdf_path: PDF保存路径，为None时不生成
+    :param options: 重新压缩的 (格式, 质量, 最大宽度)，为None时不压缩
+    :return: {"pdf": (页数, 跳过数) 或 None, "sizes": [(图片序号, 处理前大小, 处理后大小)]}
+    """
+    result = {"pdf": None, "sizes": []}
+    if pdf_path is not None:
+        result["pdf"] = export_chapter_pdf(source, pdf_path, password)
+    if options is not None:
+        result["sizes"] = recompress_chapter(source, *options)
+    return result
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+from time import time
+from typing import Optional
+from metrics import metrics
+from logger import  logger
+
+class Job:
+    """从队列中领取的一个任务"""
+    __slots__ = ("id", "kind", "key", "priority", "payload", "attempts")
+
+    def __init__(self, id: int, kind: str, key: str, priority: int, payload: dict, attempts: int):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.priority = priority
+        self.payload = payload
+        self.attempts = attempts
+
+class JobQueue:
+    """
+    持久化的任务队列（SQLite）
+
+    每一轮运行从获取收藏夹、订阅等列表开始，到队列中的任务全部完成为止，称为一个批次（epoch）。
+    任务按 (priority, id) 顺序领取，领取时加租约（lease），完成后标记done；
+    失败的任务按指数退避重新排队，超过 max_attempts 次后标记failed。
+    运行中断（如Actions超时）后再次启动时继续同一批次：
+    未完成和租约中的任务重新排队，列表已获取完毕的话不再重新获取。
+    因时间预算用完而结束（defer）的批次在下次运行时同样继续，但要重新获取收藏夹和订阅，
+    新收藏、新搜索结果不必等旧的任务全部完成。
+    图片级别的进度由数据库的images表记录（见 ComicSQLiteDB.update_images_status），
+    章节级别由episodes表记录，因此队列中只保存漫画任务。
+    """
+    def __init__(self, db_path: str, lease_seconds: float = 1800, max_attempts: int = 3):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stopped = False
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            epoch INTEGER NOT NULL,
+            priority INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL DEFAULT NULL,
+            last_error TEXT DEFAULT NULL,
+            update_time TEXT DEFAULT (datetime('now')),
+            UNIQUE (kind, key)
+        )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(epoch, status, priority, id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.epoch = self._meta("epoch", 0)
+        self.listing_done = bool(self._meta("listing_done", 0))
+        # 上次运行是否因时间预算用完而结束，begin() 时读取
+        self.deferred = False
+        metrics.register_gauge("job_queue_unfinished", self.depth)
+
+    def _meta(self, name: str, default: int) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, name: str, value: int):
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def begin(self) -> bool:
+        """
+        开始本次运行：上一批次未完成时继续该批次，否则开始新批次
+        :return: 是否为继续上一批次
+        """
+        with self._cond:
+            unfinished = self.unfinished_count()
+            if self.epoch and (unfinished or not self.listing_done):
+                # 上次运行中断时领取的任务重新排队
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'pending', lease_until = NULL "
+                    "WHERE epoch = ? AND status = 'leased'", (self.epoch,)
+                )
+                self.deferred = bool(self._meta("deferred", 0))
+                self._set_meta("deferred", 0)
+                logger.info(f"继续第{self.epoch}批任务，剩余{unfinished}本漫画")
+                return True
+            self.epoch += 1
+            self.listing_done = False
+            self.deferred = False
+            self.conn.execute("BEGIN")
+            self._set_meta("epoch", self.epoch)
+            self._set_meta("listing_done", 0)
+            self._set_meta("deferred", 0)
+            self.conn.execute("COMMIT")
+            return False
+
+    def mark_listing_done(self):
+        """本批次的列表（收藏夹、订阅、分批下载）已全部加入队列"""
+        with self._cond:
+            self.listing_done = True
+            self._set_meta("listing_done", 1)
+
+    def unfinished_count(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE epoch = ? AND status IN ('pending', 'leased')", (self.epoch,)
+        ).fetchone()[0]
+
+    def depth(self) -> int:
+        """本批次未完成的任务数（可在任意线程调用）"""
+        with self._cond:
+            return self.unfinished_count()
+
+    def put(self, kind: str, key: str, payload: dict, priority: int):
+        """
+        加入任务；同一批次中已存在的任务只提高优先级（不重复执行），
+        以前批次的任务重新排队
+        """
+        with self._cond:
+            self.conn.execute('''
+            INSERT INTO jobs (kind, key, epoch, priority, payload) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(kind, key) DO UPDATE SET
+                priority = CASE WHEN epoch = excluded.epoch THEN MIN(priority, excluded.priority)
+                                ELSE excluded.priority END,
+                payload = CASE WHEN epoch = excluded.epoch AND priority <= excluded.priority THEN payload
+                               ELSE excluded.payload END,
+                status = CASE WHEN epoch = excluded.epoch THEN status ELSE 'pending' END,
+                attempts = CASE WHEN epoch = excluded.epoch THEN attempts ELSE 0 END,
+                available_at = CASE WHEN epoch = excluded.epoch THEN available_at ELSE 0 END,
+                last_error = CASE WHEN epoch = excluded.epoch THEN last_error ELSE NULL END,
+                epoch = excluded.epoch,
+                update_time = datetime('now')
+            ''', (kind, key, self.epoch, priority, json.dumps(payload, ensure_ascii=False)))
+            self._cond.notify_all()
+
+    def _claim(self) -> Optional[Job]:
+        now = time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute('''
+            SELECT id, kind, key, priority, payload, attempts FROM jobs
+            WHERE epoch = ? AND available_at <= ?
+              AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))
+            ORDER BY priority, id LIMIT 1
+            ''', (self.epoch, now, now)).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'leased', lease_until = ?, attempts = attempts + 1, "
+                    "update_time = datetime('now') WHERE id = ?",
+                    (now + self.lease_seconds, row[0])
+                )
+        finally:
+            self.conn.execute("COMMIT")
+        if row is None:
+            return None
+        id, kind, key, priority, payload, attempts = row
+        return Job(id, kind, key, priority, json.loads(payload), attempts + 1)
+
+    def get(self) -> Optional[Job]:
+        """
+        领取优先级最高的可执行任务，暂时没有时等待；
+        close() 之后且本批次没有未完成的任务时、或 stop() 之后返回None
+        """
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                job = self._claim()
+                if job is not None:
+                    return job
+                if self._closed and self.unfinished_count() == 0:
+                    return None
+                # 等待新任务、任务结束或退避时间到期
+                next_at = self.conn.execute(
+                    "SELECT MIN(available_at) FROM jobs WHERE epoch = ? AND status = 'pending'", (self.epoch,)
+                ).fetchone()[0]
+                timeout = 1.0 if next_at is None else min(max(next_at - time(), 0.05), 1.0)
+                self._cond.wait(timeout)
+
+    def done(self, job: Job):
+        with self._cond:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', lease_until = NULL, update_time = datetime('now') WHERE id = ?",
+                (job.id,)
+            )
+            self._cond.notify_all()
+
+    def fail(self, job: Job, error: str):
+        """任务失败：未超过最大次数时退避后重新排队"""
+        with self._cond:
+            if job.attempts >= self.max_attempts:
+                status, available_at = "failed", 0
+                logger.error(f"任务{job.kind}:{job.key}失败{job.attempts}次，不再重试：{error}")
+            else:
+                status, available_at = "pending", time() + min(300, 10 * 2 ** (job.attempts - 1))
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, last_error = ?, "
+                "update_time = datetime('now') WHERE id = ?",
+                (status, available_at, error, job.id)
+            )
+            self._cond.notify_all()
+
+    def release(self, job: Job):
+        """把领取的任务放回队列，不计入失败次数（如时间预算用完时）"""
+        with self._cond:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'pending', lease_until = NULL, attempts = MAX(attempts - 1, 0), "
+                "update_time = datetime('now') WHERE id = ?",
+                (job.id,)
+            )
+            self._cond.notify_all()
+
+    def stop(self):
+        """不再领取任务，剩余的任务留给下次运行"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def defer(self):
+        """时间预算用完：同 stop()，并记录下来，下次运行继续本批次时重新获取收藏夹和订阅"""
+        with self._cond:
+            self._set_meta("deferred", 1)
+        self.stop()
+
+    def close(self):
+        """不再加入新任务，get() 在任务全部完成后返回None"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def summary(self) -> str:
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE epoch = ? GROUP BY status", (self.epoch,)
+        ).fetchall()
+        return f"第{self.epoch}批：" + "，".join(f"{status}:{count}" for status, count in rows)
@@ -0,0 +1,107 @@
+"""
+统计事件日志（logs/events_<日期>.jsonl，见 events.py）
+
+逐行读取，不把整个文件载入内存，输出：
+    每天的下载量与速度（图片数、MB、运行时长、MB/秒、张/秒）
+    失败最多的主机和状态码（请求失败 http_error 与未下载完的章节）
+    耗时最长的漫画
+
+用法：
+    python src/log_stats.py --dir logs --days 7 --top 10
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+def iter_events(log_dir: str, days: int = 0):
+    """按日期顺序逐行读取事件，days 不为0时只读最近 days 天的文件"""
+    paths = sorted(glob.glob(os.path.join(log_dir, "events_*.jsonl")))
+    if days:
+        first = (date.today() - timedelta(days=days - 1)).isoformat()
+        paths = [path for path in paths if os.path.basename(path)[len("events_"):-len(".jsonl")] >= first]
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 进程被中断时最后一行可能不完整
+                    continue
+
+class Stats:
+    def __init__(self, top: int):
+        self.top = top
+        # 日期 → 运行事件与章节事件的合计
+        self.runs = defaultdict(lambda: {"runs": 0, "images": 0, "bytes": 0, "seconds": 0.0})
+        self.episodes = defaultdict(lambda: {"images": 0, "bytes": 0, "seconds": 0.0})
+        self.host_failures = Counter()
+        self.comic_failures = Counter()
+        self.titles = {}
+        # 耗时最长的 top 本漫画（小顶堆），同一本漫画多次出现时各算一次
+        self.slowest = []
+
+    def add(self, event: dict):
+        kind = event.get("event")
+        day = event.get("ts", "")[:10]
+        if kind == "run":
+            run = self.runs[day]
+            run["runs"] += 1
+            run["images"] += event.get("images") or 0
+            run["bytes"] += event.get("bytes") or 0
+            run["seconds"] += event.get("duration") or 0
+        elif kind == "episode":
+            episode = self.episodes[day]
+            episode["images"] += event.get("downloaded") or 0
+            episode["bytes"] += event.get("bytes") or 0
+            episode["seconds"] += event.get("duration") or 0
+            if event.get("status") != "ok":
+                self.comic_failures[event.get("comic_id")] += 1
+                self.titles[event.get("comic_id")] = event.get("title")
+        elif kind == "http_error":
+            self.host_failures[(event.get("host"), str(event.get("status")))] += 1
+        elif kind == "comic":
+            if event.get("status") == "failed":
+                self.comic_failures[event.get("comic_id")] += 1
+                self.titles[event.get("comic_id")] = event.get("title")
+            item = (event.get("duration") or 0, day, event.get("comic_id"), event.get("title"), event.get("status"))
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def report(self):
+        print("每日下载量：")
+        print(f"  {'日期':<10}  {'图片':>8}  {'MB':>9}  {'秒':>8}  {'MB/秒':>7}  {'张/秒':>7}")
+        for day in sorted(set(self.runs) | set(self.episodes)):
+            # 有运行事件时按整次运行的时长计算速度，否则（运行被中断）按章节合计
+            total = self.runs[day] if self.runs.get(day, {}).get("seconds") else self.episodes[day]
+            images, mb, seconds = total["images"], total["bytes"] / 1024 / 1024, total["seconds"]
+            print(f"  {day:<10}  {images:>8}  {mb:>9.1f}  {seconds:>8.0f}  "
+                  f"{mb / seconds if seconds else 0:>7.2f}  {images / seconds if seconds else 0:>7.2f}")
+        print(f"\n失败最多的主机（前{self.top}）：")
+        for (host, status), count in self.host_failures.most_common(self.top):
+            print(f"  {count:>6}  {host}  {status}")
+        print(f"\n失败最多的漫画（前{self.top}）：")
+        for comic_id, count in self.comic_failures.most_common(self.top):
+            print(f"  {count:>6}  {comic_id}  {self.titles.get(comic_id)}")
+        print(f"\n耗时最长的漫画（前{self.top}）：")
+        for duration, day, comic_id, title, status in sorted(self.slowest, reverse=True):
+            print(f"  {duration:>8.1f}秒  {day}  {comic_id}  {title}  {status}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="统计事件日志")
+    parser.add_argument("--dir", default="./logs", help="事件日志目录（logging.events_dir）")
+    parser.add_argument("--days", type=int, default=0, help="只统计最近几天，0为全部")
+    parser.add_argument("--top", type=int, default=10, help="每项列出的条数")
+    args = parser.parse_args(argv)
+    stats = Stats(args.top)
+    for event in iter_events(args.dir, args.days):
+        stats.add(event)
+    stats.report()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import atexit
 import logging
+import queue
 import re
 from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 import os
 
 def setup_rotating_logger():
@@ -54,5 +56,76 @@ def setup_rotating_logger():
 
     return logger
 
+class _ThreadQueueHandler(QueueHandler):
+    """同一进程内的日志队列：记录原样放入队列，消息的格式化留给写日志的后台线程"""
+    def prepare(self, record):
+        return record
+
+class ModuleLevelFilter(logging.Filter):
+    """按模块（文件名）过滤日志，没有单独设置的模块使用 default_level"""
+    def __init__(self, default_level: int, module_levels: dict):
+        super().__init__()
+        self.default_level = default_level
+        self.module_levels = module_levels
+
+    def filter(self, record):
+        return record.levelno >= self.module_levels.get(record.module, self.default_level)
+
+def parse_module_levels(text: str) -> dict:
+    """解析 "database=WARNING,downloader=INFO" 形式的模块日志级别"""
+    levels = {}
+    for item in (text or "").split(","):
+        if "=" in item:
+            module, level = item.split("=", 1)
+            levels[module.strip()] = logging.getLevelName(level.strip().upper())
+    return {module: level for module, level in levels.items() if isinstance(level, int)}
+
+_handlers = []
+_listener = None
+
+def configure_logging():
+    """
+    按配置文件的 logging 段调整日志：
+    queue 开启时日志记录放入队列，由后台线程格式化并写入文件和控制台，工作线程不等待日志I/O；
+    console_level/file_level 为控制台和文件的级别，module_levels 按模块单独设置级别。
+    日志器的级别取其中最低的一个，低于该级别的日志调用直接返回，不创建日志记录。
+    """
+    global _listener
+    # util 导入了本模块，这里延迟导入
+    from util import get_config
+    console_level = logging.getLevelName(str(get_config("logging", "console_level", "INFO")).upper())
+    file_level = logging.getLevelName(str(get_config("logging", "file_level", "DEBUG")).upper())
+    console_level = console_level if isinstance(console_level, int) else logging.INFO
+    file_level = file_level if isinstance(file_level, int) else logging.DEBUG
+    module_levels = parse_module_levels(get_config("logging", "module_levels", ""))
+    if not _handlers:
+        _handlers.extend(logger.handlers)
+    for handler in _handlers:
+        if isinstance(handler, TimedRotatingFileHandler):
+            handler.setLevel(file_level)
+        else:
+            handler.setLevel(console_level)
+    default_level = min(console_level, file_level)
+    logger.setLevel(min([default_level, *module_levels.values()]))
+    for old in [f for f in logger.filters if isinstance(f, ModuleLevelFilter)]:
+        logger.removeFilter(old)
+    if module_levels:
+        logger.addFilter(ModuleLevelFilter(default_level, module_levels))
+    if get_config("logging", "queue", False) and _listener is None:
+        records = queue.SimpleQueue()
+        _listener = QueueListener(records, *_handlers, respect_handler_level=True)
+        _listener.start()
+        logger.handlers = [_ThreadQueueHandler(records)]
+        # 在 logging 自身的退出处理之前把队列中剩余的日志写完
+        atexit.register(stop_logging)
+
+def stop_logging():
+    """写完队列中剩余的日志，恢复为在调用线程中直接写入"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logger.handlers = list(_handlers)
+
 # 初始化日志器（全局单例，其他文件导入时直接用）
 logger = setup_rotating_logger()
\ No newline at end of file
@@ -1,55 +1,59 @@
+import argparse
+import importlib.util
 import os
+from time import monotonic
 from datetime import datetime
 import urllib3
-from time import sleep
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-from logger import  logger
+from logger import  logger, configure_logging
 from api import *
 from database import ComicSQLiteDB
+from session import pool_stats, close_session
+from downloader import download
+from blobstore import close_blob_store
+from archive import open_chapter_archive
+from postprocess import submit_chapter, close_post_processor
+from sync import pending_episodes
+from jobqueue import JobQueue
+from budget import BudgetExhausted, get_time_budget, start_time_budget
+from metrics import metrics, start_metrics, close_metrics
+from events import emit_event, start_event_log, close_event_log
+from pipeline import DownloadPipeline, PRIORITY_FAVOURITE, PRIORITY_SUBSCRIBE, PRIORITY_ALL
 
-def download(name_len,folder_path: str, i: int, url: str, retries=3,):
-    for attempt in range(retries):
-        path = os.path.join(folder_path, (str(i + 1).zfill(name_len)+'.jpg'))
-        try:
-            if os.path.exists(path):
-                return
-            response = http_do("GET", url=url)
-            if response.status_code == 200:
-                with open(path, 'wb') as f:
-                    f.write(response.content)
-                return
-            else:
-                logger.warning(f"Attempt {attempt + 1} failed for {url}, status code: {response.status_code}")
-        except requests.exceptions.Timeout:
-            logger.error(f"Attempt {attempt+1} timeout for {url}")
-        except Exception as e:
-            logger.error(f"Attempt {attempt+1} error for {url}: {e}")
-    raise Exception(f"Failed to download {url} after {retries} attempts.")
+#数据库，由 main() 初始化
+db: ComicSQLiteDB = None
 
 #下载漫画
 def download_comic(comic,executor:ThreadPoolExecutor):
+    """
+    下载漫画中未下载的章节，增量模式下漫画没有更新时返回False
+    时间预算不足以开始下一个章节时，等已开始的章节下载完后抛出 BudgetExhausted
+    """
     cid = comic["_id"]
     title = comic["title"]
-    logger.info(f"开始检查{title}是否存在未下载章节")
+    logger.info("开始检查%s是否存在未下载章节", title)
     author = comic["author"]
     categories = comic["categories"]
-    episodes = episodes_all(cid, title)
+    version = comic_version(comic)
+    incremental = get_config("download", "incremental", False)
+    episodes = pending_episodes(db, comic, version, incremental)
+    if episodes is None:
+        return False
     num_pages = comic["pagesCount"] if "pagesCount" in comic else -1
     is_detail = get_config("download","is_detail")
-    if db.is_comic_downloaded(comic["_id"]):
-        episodes = [episode for episode in episodes
-                    if not db.is_episode_downloaded(comic["_id"], episode["title"])]
+    stream = get_config("download", "stream_download", False)
+    use_ledger = get_config("download", "image_ledger", False)
     if episodes:
         logger.info(
             '正在下载:[%s]-[%s]-[%s]-[total_pages:%d]' %
             (title, author, categories, num_pages)
         )
-        logger.info(episodes)
+        logger.debug("待下载章节：%s", episodes)
     else:
         logger.info(f"{title}中没有可下载章节")
-        return
+        return True
     #数据库加入该漫画
     db.mark_comic_as_downloaded(comic["_id"])
     comic_path = os.path.join(".",
@@ -57,90 +61,170 @@ def download_comic(comic,executor:ThreadPoolExecutor):
                               f"{convert_file_name(title)}"
                             )
     comic_path = ensure_valid_path(comic_path)
-    for episode in episodes:
-        chapter_title = convert_file_name(episode["title"])
-        chapter_path = os.path.join(comic_path, chapter_title)
-        chapter_path = Path(chapter_path)
-        chapter_path.mkdir(parents=True, exist_ok=True)
-        image_urls = []
-        current_page = 1
+    # 生产者/消费者流水线：主线程逐页获取图片地址，每获取一页就立即把图片提交给下载线程池，
+    # 下一章节的列表获取与上一章节的图片下载同时进行
+    budget = get_time_budget()
+    estimate = budget.episode_images(comic)
+    pending = []
+    exhausted = False
+    try:
+        for episode in episodes:
+            if not budget.try_start(estimate):
+                exhausted = True
+                break
+            chapter_title = convert_file_name(episode["title"])
+            chapter_path = os.path.join(comic_path, chapter_title)
+            chapter_path = Path(chapter_path)
+            chapter_path.mkdir(parents=True, exist_ok=True)
+            archive = open_chapter_archive(chapter_path)
+            started = monotonic()
+            try:
+                jobs = submit_episode(executor, cid, episode, chapter_path, stream, use_ledger, version, archive)
+            except BaseException:
+                # submit_episode 已等待本章节提交过的图片下载结束
+                if archive is not None:
+                    archive.close(complete=False)
+                budget.finish(estimate, 0)
+                raise
+            if not jobs:
+                logger.warning(f"{title}{chapter_title}没有找到图片")
+                if archive is not None:
+                    archive.close(complete=False)
+                budget.finish(estimate, 0)
+                continue
+            logger.info("找到 %d 张图片在:%s", len(jobs), chapter_title)
+            pending.append((episode, jobs, chapter_path, archive, started))
+            # 顺便结算已经下载完的章节，及时记录进度
+            while pending and all(future.done() for _, _, future in pending[0][1]):
+                finish_episode(comic, *pending.pop(0), is_detail, use_ledger)
+    finally:
+        # 获取后面章节的图片列表出错时，已提交的章节同样要结算：
+        # 等待图片下载结束、记录进度、关闭压缩包、归还时间预算，然后再抛出异常
+        while pending:
+            finish_episode(comic, *pending.pop(0), is_detail, use_ledger)
+    if exhausted:
+        raise BudgetExhausted()
+    return True
+
+def submit_episode(executor: ThreadPoolExecutor, cid, episode, chapter_path, stream, use_ledger=True, version=None,
+                   archive=None) -> list:
+    """
+    逐页获取章节的图片地址，每获取到一页就把其中的图片提交到下载线程池
+    开启图片下载记录时，优先从数据库恢复已获取过的图片列表
+    :param archive: 章节压缩包，输出为普通文件夹时为None
+    :return: [(图片序号, 图片地址, Future)]
+    """
+    if use_ledger:
+        images = db.get_episode_images(cid, episode["order"])
+        if images:
+            return resume_episode(executor, episode, images, chapter_path, stream, archive)
+    jobs = []
+    first_page = picture_page(cid, episode["order"], 1, version)
+    # 文件名位数由章节图片总数决定，第一页即可得知
+    name_len = 3 if first_page["total"] < 1000 else 4
+    current_page = 1
+    page_data = first_page
+    try:
         while True:
-            page_data = json.loads(
-                picture(cid, episode["order"], current_page).content
-            )["data"]["pages"]["docs"]
-            # print_full_json(page_data)
+            for doc in page_data["docs"]:
+                index = len(jobs)
+                image_url = media_url(doc['media'])
+                future = executor.submit(download, name_len, chapter_path, index, image_url, stream=stream,
+                                         archive=archive)
+                jobs.append((index, image_url, future))
             current_page += 1
-            if page_data:
-                image_urls.extend(list(map(
-                    lambda i: i['media']['fileServer'] + '/static/' + i['media']['path'],
-                    page_data
-                )))
-            else:
+            if current_page > first_page["pages"]:
                 break
-        if not image_urls:
-            logger.warning(f"{title}{chapter_title}没有找到图片")
-            continue
-        logger.info(f"找到 {len(image_urls)} 张图片在:{chapter_title}")
-        if len(image_urls) <1000:
-            name_len = 3
-        else:
-            name_len = 4
+            page_data = picture_page(cid, episode["order"], current_page, version)
+    except BaseException:
+        # 图片列表不完整，不写入下载记录；等已提交的图片下载结束，调用方才能安全地关闭压缩包
+        wait([future for _, _, future in jobs])
+        raise
+    if use_ledger and jobs:
+        # 图片列表完整获取后一次性写入，下次运行可直接从记录恢复
+        db.save_episode_images(cid, episode["order"], [image_url for _, image_url, _ in jobs])
+    return jobs
 
-        downloaded_count = 0
-        futures = {
-            executor.submit(download,name_len,
-                            chapter_path,
-                            image_urls.index(image_url),image_url,
-                            ): image_url
-            for image_url in image_urls
-        }
-        for future in as_completed(futures):
-            image_url = futures[future]
-            try:
-                future.result()
-                downloaded_count += 1
-            except Exception as e:
-                current_image = image_urls.index(image_url) + 1
-                episode_title = episode["title"]
-                logger.error(f"Error downloading the {current_image}-th image"
-                          f"in episode:{episode_title}"
-                          f"in comic:{title}"
-                          f"Exception:{e}")
-                continue
-        if is_detail:
-            episode_title = episode["title"]
-            logger.info(
-                f"[episode:{episode_title:<10}] "
-                f"downloaded:{downloaded_count:>6}, "
-                f"total:{len(image_urls):>4}, "
-                f"progress:{int(downloaded_count / len(image_urls) * 100):>3}%",
-            )
-        if downloaded_count == len(image_urls):
-            db.update_downloaded_episodes(comic["_id"], episode["title"])
+def resume_episode(executor: ThreadPoolExecutor, episode, images: list, chapter_path, stream, archive=None) -> list:
+    """
+    根据数据库中的图片记录恢复章节下载：不再请求图片列表，已完成的图片也不再检查文件
+    输出为压缩包时以压缩包中的内容为准（download 会跳过已在压缩包中的图片）
+    :return: [(图片序号, 图片地址, Future)]，已完成图片的Future结果为None
+    """
+    name_len = 3 if len(images) < 1000 else 4
+    jobs = []
+    for image in images:
+        if image["status"] == "done" and archive is None:
+            future = Future()
+            future.set_result(None)
         else:
-            episode_title = episode["title"]
-            logger.error(
-                f"Failed to download the episodes:{episode_title} "
-                f"of comic:{title}. "
-                f"Currently, {downloaded_count} images(total_images:{len(image_urls)}) "
-                "from this episode have been downloaded"
-            )
-        sleep(1)
+            future = executor.submit(download, name_len, chapter_path, image["page_index"], image["url"],
+                                     stream=stream, archive=archive)
+        jobs.append((image["page_index"], image["url"], future))
+    done_count = sum(1 for image in images if image["status"] == "done")
+    logger.info("从下载记录恢复章节%s：共%d张，已完成%d张", episode['title'], len(images), done_count)
+    return jobs
 
+def finish_episode(comic, episode, jobs: list, chapter_path, archive, started, is_detail, use_ledger=True):
+    """
+    等待章节的全部图片下载结束，全部成功则记录为已下载章节
+    输出为压缩包时同时关闭压缩包；完整的章节交给进程池做PDF导出、重新压缩等后处理
+    :param started: 开始获取图片列表的时间（monotonic），用于事件日志中的章节耗时
+    """
+    title = comic["title"]
+    episode_title = episode["title"]
+    downloaded_count = 0
+    results = []
+    for index, image_url, future in jobs:
+        try:
+            result = future.result()
+            downloaded_count += 1
+            if result is not None:
+                results.append((index, "done", *result))
+        except Exception as e:
+            results.append((index, "failed", None, None))
+            logger.error(f"Error downloading the {index + 1}-th image"
+                      f"in episode:{episode_title}"
+                      f"in comic:{title}"
+                      f"Exception:{e}")
+    if archive is not None:
+        archive.close(complete=downloaded_count == len(jobs))
+    fetched = [result for result in results if result[1] == "done"]
+    get_time_budget().finish(get_time_budget().episode_images(comic), len(fetched))
+    emit_event("episode", comic_id=comic["_id"], title=title, episode=episode_title, order=episode["order"],
+               images=len(jobs), downloaded=len(fetched), failed=len(jobs) - downloaded_count,
+               bytes=sum(result[2] or 0 for result in fetched), duration=round(monotonic() - started, 3),
+               status="ok" if downloaded_count == len(jobs) else "incomplete")
+    if use_ledger and results:
+        db.update_images_status(comic["_id"], episode["order"], results)
+    if is_detail:
+        logger.info(
+            f"[episode:{episode_title:<10}] "
+            f"downloaded:{downloaded_count:>6}, "
+            f"total:{len(jobs):>4}, "
+            f"progress:{int(downloaded_count / len(jobs) * 100):>3}%",
+        )
+    if downloaded_count == len(jobs):
+        db.update_downloaded_episodes(comic["_id"], episode_title, episode.get("_id"), episode["order"])
+        submit_chapter(db, comic["_id"], episode, chapter_path, archive)
+    else:
+        logger.error(
+            f"Failed to download the episodes:{episode_title} "
+            f"of comic:{title}. "
+            f"Currently, {downloaded_count} images(total_images:{len(jobs)}) "
+            "from this episode have been downloaded"
+        )
 
 def search_all(the_keyword):
     subscribed_comics = []
     categories = get_config("download","filter").split(',')
-    download_page = get_config("download","page")
+    download_page = int(get_config("download","page", 1))
     if the_keyword:
         db.mark_comic_as_downloaded(the_keyword)
         last_title = db.get_title_by_comic_id(the_keyword)
         this_title = ""
-        total_pages_num = search(the_keyword)["pages"]
-        if total_pages_num < download_page:
-            download_page = total_pages_num
-        for page in range(1, download_page+1):
-            page_docs = search(the_keyword, page)["docs"]
+        for page, page_data in enumerate(search_pages(the_keyword, download_page), start=1):
+            page_docs = page_data["docs"]
             for idx, doc in enumerate(page_docs):
                 if idx == 1 and page == 1:
                     this_title = doc["title"]
@@ -163,7 +247,11 @@ def search_all(the_keyword):
         db.save_comic(last_comic)
     return subscribed_comics
 
-def download_all_comics():
+def download_all_comics(batches: int):
+    """
+    从旧到新分批添加全部漫画，每批一页，多页并发获取
+    :param batches: 本次添加的页数
+    """
     all_comics = []
     categories = get_config("download", "filter").split(',')
     download_name = "old_to_nwe"
@@ -174,96 +262,108 @@ def download_all_comics():
     total_comic = res["total"]
     if page >= total_page:
         logger.info(f"已经下载了{page}页，一共{total_page}页，现在开始下载最新章节")
-    logger.info(f"已经下载了{page}页，一共{total_page}页，现在开始添加第{page+1}页")
-    page_docs = get_old_update(page+1)["docs"]
-    for doc in page_docs:
-        intersection = set(doc['categories']).intersection(set(categories))
-        if len(intersection) == 0:
-            all_comics.append(doc)
+    logger.info(f"已经下载了{page}页，一共{total_page}页，现在开始添加第{page+1}到{page+batches}页")
+    for page_data in get_old_update_pages(range(page + 1, page + batches + 1)):
+        for doc in page_data["docs"]:
+            intersection = set(doc['categories']).intersection(set(categories))
+            if len(intersection) == 0:
+                all_comics.append(doc)
     new = {
         "comic_id": download_name,
-        "pagesCount": page+1,
+        "pagesCount": page+batches,
         "total_comic": total_comic,
         "totalPages": total_page,
     }
     db.save_download_info(new)
     return all_comics
 
-if __name__ == "__main__":
-    logger.info("=======================================================================")
-    #初始化数据库
-    db = ComicSQLiteDB("./data/comic_spider.db")
-    #获取累计的下载数量
-    logger.info('已经累计下载%d本漫画' %db.get_downloaded_comic_count())
-    #登录
-    login()
+def save_comic_detail(data, check_favourite=False):
+    """
+    记录漫画详情到数据库
+    :param data: comic_info 返回的 data.comic
+    :param check_favourite: 是否按配置对收藏夹内的漫画执行取消收藏
+    """
+    comic_id = data["_id"]
+    title = data["title"]
+    author = data["author"]
+    finished = data["finished"]
+    pagesCount = data["pagesCount"]
+    category_list = data["categories"]
+    category = ",".join(category_list) if isinstance(category_list, list) else ""
+    epsCount = data["epsCount"]
+    update_time = data["updated_at"]
+    # 单行输出，多线程下不会与其他日志交错
+    logger.info(
+        "漫画信息：%s | ID:%s | 作者:%s | 完结:%s | 总页数:%s | 章节数:%s | 分类:%s | 更新:%s",
+        title, comic_id, author, "是" if finished else "否", pagesCount, epsCount, category, update_time
+    )
+    add_comic ={
+        "comic_id": comic_id,
+        "title": title,
+        "author": author,
+        "finished": finished,
+        "pagesCount": pagesCount,
+        "category": category,
+        "epsCount": epsCount,
+        "update_time": update_time,
+    }
+    db.save_comic(add_comic)
+    if not check_favourite:
+        return
+    is_remove_favorites = get_config(section="download", key="remove_favorites")
+    #如果设置了下载取消收藏，并且是已经完结的作品，则取消收藏
+    if is_remove_favorites and data['isFavourite'] and data["finished"]:
+        favourite(data["_id"])
+        logger.info(f"{title}已经取消收藏！")
+    #如果设置了下载取消收藏，没有完结，但长时间不更新则取消收藏
+    if is_remove_favorites and data['isFavourite'] and data["finished"] == False:
+        if compare_time(data["updated_at"]):
+            favourite(data["_id"])
+            logger.info(f"长时间未更新{title}已经取消收藏！")
+
+def process_comic(the_comic, executor, check_favourite=False):
+    """下载一本漫画并记录漫画详情（线程引擎中由漫画线程调用），失败时抛出异常，由任务队列重试"""
+    try:
+        #开始下载
+        if not download_comic(the_comic,executor) and not check_favourite:
+            # 没有更新的漫画不再请求详情；收藏夹内的漫画仍需检查是否取消收藏
+            return
+        info = comic_info(the_comic['_id'], comic_version(the_comic))
+        save_comic_detail(info["data"]['comic'], check_favourite)
+    except BudgetExhausted:
+        raise
+    except Exception as e:
+        logger.error(
+            'Download failed for {}, with Exception:{}'.format(the_comic["title"], e)
+        )
+        raise
+
+def create_pipeline(jobs: JobQueue):
+    """按配置的下载引擎（download.engine）创建贯穿整个运行过程的下载流水线"""
+    thread_number = int(get_config(section="download", key="thread_number"))
+    max_inflight = int(get_config(section="download", key="max_inflight", default_value=64))
+    comic_workers = int(get_config(section="download", key="comic_workers", default_value=2))
+    engine = get_config(section="download", key="engine", default_value="thread")
+    if engine == "asyncio" and importlib.util.find_spec("aiohttp") is None:
+        logger.warning("asyncio引擎需要安装aiohttp（pip install aiohttp），本次使用线程引擎")
+    elif engine == "asyncio":
+        from aio_engine import AsyncPipeline
+        return AsyncPipeline(db, jobs, on_detail=lambda info, check_favourite: save_comic_detail(
+            info["data"]['comic'], check_favourite))
+    return DownloadPipeline(process_comic, comic_workers, thread_number, max_inflight, jobs)
+
+def list_sources(pipeline, with_download_plan=True):
+    """
+    获取收藏夹、订阅、分批下载三种来源的漫画，加入下载流水线
+    :param with_download_plan: 为False时不添加分批下载的漫画（分批下载的页数不前进）
+    """
     #获取收藏夹的漫画数量
     favourite_comics = my_favourite_all()
-    #获取下载的线程数
     logger.info('收藏夹共计%d本漫画' % (len(favourite_comics)))
-    thread_number = get_config(section="download", key="thread_number")
     #开始下载收藏夹内容
     logger.info("开始下载收藏夹内未下载内容")
-    with ThreadPoolExecutor(max_workers=thread_number) as executor:
-        for the_comic in favourite_comics:
-            try:
-                #开始下载
-                download_comic(the_comic,executor)
-                info = comic_info(the_comic['_id'])
-                data = info["data"]['comic']
-                is_remove_favorites = get_config(section="download", key="remove_favorites")
-                comic_id = data["_id"]
-                title = data["title"]
-                author = data["author"]
-                finished = data["finished"]
-                pagesCount = data["pagesCount"]
-                category_list = data["categories"]
-                category = ",".join(category_list) if isinstance(category_list, list) else ""
-                epsCount = data["epsCount"]
-                update_time = data["updated_at"]
-                logger.info(
-                    f"""
-
-                ==================== 漫画信息 ====================
-                漫画ID：{comic_id}
-                标题：{title}
-                作者：{author}
-                是否完结：{"是" if finished else "否"}
-                总页数：{pagesCount}
-                分类：{category}
-                章节数：{epsCount}
-                最后更新时间：{update_time}
-                =================================================
-                    """.strip()  # strip() 去掉首尾空行，让日志更整洁
-                )
-                add_comic ={
-                    "comic_id": comic_id,
-                    "title": title,
-                    "author": author,
-                    "finished": finished,
-                    "pagesCount": pagesCount,
-                    "category": category,
-                    "epsCount": epsCount,
-                    "update_time": update_time,
-                }
-                db.save_comic(add_comic)
-
-                #如果设置了下载取消收藏，并且是已经完结的作品，则取消收藏
-                if is_remove_favorites and data['isFavourite'] and data["finished"]:
-                    favourite(data["_id"])
-                    logger.info(f"{title}已经取消收藏！")
-                #如果设置了下载取消收藏，没有完结，但长时间不更新则取消收藏
-                if is_remove_favorites and data['isFavourite'] and data["finished"] == False:
-                    if compare_time(data["updated_at"]):
-                        favourite(data["_id"])
-                        logger.info(f"长时间未更新{title}已经取消收藏！")
-
-            except Exception as e:
-                logger.error(
-                    'Download failed for {}, with Exception:{}'.format(the_comic["title"], e)
-                )
-                continue
-    logger.info("收藏夹内容下载完毕")
+    for the_comic in favourite_comics:
+        pipeline.put(the_comic, PRIORITY_FAVOURITE, check_favourite=True)
     #开始下载订阅内容
     logger.info("开始下载订阅内容")
     searched_comics = []
@@ -271,110 +371,87 @@ if __name__ == "__main__":
     for keyword in keywords:
         searched_comic = search_all(keyword)
         logger.info(f"关键词{keyword}找到{len(searched_comic)}本漫画")
+        for the_comic in searched_comic:
+            pipeline.put(the_comic, PRIORITY_SUBSCRIBE)
         searched_comics += searched_comic
     logger.info('订阅内容共计%d本漫画' % (len(searched_comics)))
-    with ThreadPoolExecutor(max_workers=thread_number) as executor:
-        for the_comic in searched_comics:
-            try:
-                #开始下载
-                download_comic(the_comic,executor)
-                info = comic_info(the_comic['_id'])
-                data = info["data"]['comic']
-                comic_id = data["_id"]
-                title = data["title"]
-                author = data["author"]
-                finished = data["finished"]
-                pagesCount = data["pagesCount"]
-                category_list = data["categories"]
-                category = ",".join(category_list) if isinstance(category_list, list) else ""
-                epsCount = data["epsCount"]
-                update_time = data["updated_at"]
-                logger.info(
-                    f"""
-
-                                ==================== 漫画信息 ====================
-                                漫画ID：{comic_id}
-                                标题：{title}
-                                作者：{author}
-                                是否完结：{"是" if finished else "否"}
-                                总页数：{pagesCount}
-                                分类：{category}
-                                章节数：{epsCount}
-                                最后更新时间：{update_time}
-                                =================================================
-                                    """.strip()  # strip() 去掉首尾空行，让日志更整洁
-                )
-                add_comic = {
-                    "comic_id": comic_id,
-                    "title": title,
-                    "author": author,
-                    "finished": finished,
-                    "pagesCount": pagesCount,
-                    "category": category,
-                    "epsCount": epsCount,
-                    "update_time": update_time,
-                }
-                db.save_comic(add_comic)
-            except Exception as e:
-                logger.error(
-                    'Download failed for {}, with Exception:{}'.format(the_comic["title"], e)
-                )
-                continue
-    logger.info("订阅内容内容下载完毕")
+    if not with_download_plan:
+        return
     logger.info("开始分批下载全部章节")
     db.create_download_all_info()
     the_all_comics = []
     download_plan = int(get_config(section="download", key="download_plan", default_value=0))
+    # 限时运行时按上次运行的结果调整页数
+    download_plan = get_time_budget().download_plan(download_plan)
     if download_plan >0:
-        for download_num in range(download_plan):
-            the_all_comics += download_all_comics()
+        the_all_comics = download_all_comics(download_plan)
     logger.info('分批下载共计%d本漫画' % (len(the_all_comics)))
-    with ThreadPoolExecutor(max_workers=thread_number) as executor:
-        for the_comic in the_all_comics:
-            try:
-                # 开始下载
-                download_comic(the_comic, executor)
-                info = comic_info(the_comic['_id'])
-                data = info["data"]['comic']
-                comic_id = data["_id"]
-                title = data["title"]
-                author = data["author"]
-                finished = data["finished"]
-                pagesCount = data["pagesCount"]
-                category_list = data["categories"]
-                category = ",".join(category_list) if isinstance(category_list, list) else ""
-                epsCount = data["epsCount"]
-                update_time = data["updated_at"]
-                logger.info(
-                    f"""
+    for the_comic in the_all_comics:
+        pipeline.put(the_comic, PRIORITY_ALL)
 
-                                   ==================== 漫画信息 ====================
-                                   漫画ID：{comic_id}
-                                   标题：{title}
-                                   作者：{author}
-                                   是否完结：{"是" if finished else "否"}
-                                   总页数：{pagesCount}
-                                   分类：{category}
-                                   章节数：{epsCount}
-                                   最后更新时间：{update_time}
-                                   =================================================
-                                       """.strip()  # strip() 去掉首尾空行，让日志更整洁
-                )
-                add_comic = {
-                    "comic_id": comic_id,
-                    "title": title,
-                    "author": author,
-                    "finished": finished,
-                    "pagesCount": pagesCount,
-                    "category": category,
-                    "epsCount": epsCount,
-                    "update_time": update_time,
-                }
-                db.save_comic(add_comic)
-            except Exception as e:
-                logger.error(
-                    'Download failed for {}, with Exception:{}'.format(the_comic["title"], e)
-                )
-                continue
+def main(argv=None):
+    """
+    完整的下载流程：登录、获取收藏夹/订阅/分批下载列表并下载，最后汇总统计
+    :param argv: 命令行参数，为None时取 sys.argv（基准测试中直接调用，见 bench/bench.py）
+    """
+    parser = argparse.ArgumentParser(description="哔咔漫画下载")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="本次运行的时间预算（分钟），来不及完成的章节不再开始，默认取 download.time_budget")
+    args = parser.parse_args(argv)
+    configure_logging()
+    logger.info("=======================================================================")
+    #从启动时开始计时，限时运行时到截止时间前结束
+    time_budget = args.time_budget if args.time_budget is not None else \
+        float(get_config("download", "time_budget", 0))
+    budget = start_time_budget(time_budget, float(get_config("download", "time_budget_reserve", 5)),
+                               "./data/throughput.json")
+    start_metrics()
+    start_event_log()
+    #初始化数据库
+    global db
+    db = ComicSQLiteDB("./data/comic_spider.db")
+    #获取累计的下载数量
+    logger.info('已经累计下载%d本漫画' %db.get_downloaded_comic_count())
+    #登录
+    login()
+    #持久化任务队列：上次运行中断时从中断处继续
+    jobs = JobQueue("./data/jobs.db",
+                    lease_seconds=float(get_config("download", "job_lease", 1800)),
+                    max_attempts=int(get_config("download", "job_max_attempts", 3)))
+    resumed = jobs.begin()
+    #三种来源的漫画共用一条下载流水线，收藏夹优先
+    pipeline = create_pipeline(jobs)
+    if resumed and jobs.listing_done and not jobs.deferred:
+        logger.info("上次运行已获取全部列表，直接继续未完成的漫画")
+    elif resumed and jobs.listing_done:
+        # 上次运行因时间预算用完而结束：重新获取收藏夹和订阅（同一批次中已有的任务不会重复），
+        # 分批下载的漫画还在队列中，页数不再前进
+        logger.info("上次运行时间预算用完，重新获取收藏夹和订阅，继续未完成的漫画")
+        list_sources(pipeline, with_download_plan=False)
+    else:
+        list_sources(pipeline)
+        jobs.mark_listing_done()
+    #等待流水线中的漫画全部下载完
+    pipeline.join()
+    logger.info(f"任务队列统计：{jobs.summary()}")
+    logger.info(f"下载统计：{budget.summary()}")
+    emit_event("run", duration=round(monotonic() - budget.start, 3),
+               status="budget_exhausted" if budget.exhausted else "ok",
+               images=int(metrics.counter_total("images_total", result="downloaded")),
+               bytes=int(metrics.counter_total("download_bytes_total")), jobs=jobs.summary())
+    budget.close()
+    #等待PDF导出、重新压缩等后处理任务
+    close_post_processor()
+    #提交数据库中剩余的写操作
+    db.close()
+
+    logger.info("本次任务下载完毕")
+    logger.info(f"连接池统计：{pool_stats.summary()}")
+    close_response_cache()
+    close_blob_store()
+    close_session()
+    close_metrics()
+    close_event_log()
 
-    logger.info("本次任务下载完毕")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import bisect
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from util import get_config
+from logger import  logger
+
+# 请求耗时的桶边界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 漫画、章节等长任务耗时的桶边界（秒）
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# 接口路径中的漫画ID、章节序号等，统计时合并为同一个接口
+_ID_SEGMENT = re.compile(r"^(?:[0-9a-f]{24}|\d+)$")
+
+def endpoint_of(url: str) -> str:
+    """请求地址对应的接口名，如 comics/:id/order/:id/pages；静态文件统一为 static"""
+    parsed = urlparse(url)
+    path = parsed.path.strip("/")
+    if path.startswith("static/") or "/static/" in parsed.path:
+        return "static"
+    return "/".join(":id" if _ID_SEGMENT.match(segment) else segment
+                    for segment in path.split("/")) or "/"
+
+class Histogram:
+    """固定桶的直方图，分位数在桶内按线性插值估算"""
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": round(self.quantile(0.5), 4),
+            "p90": round(self.quantile(0.9), 4),
+            "p99": round(self.quantile(0.99), 4),
+            "max": round(self.max, 4),
+        }
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    items = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+class Metrics:
+    """
+    运行指标（线程安全）：计数器、直方图，以及在采样时读取的仪表（队列长度、并发数等）
+
+    仪表每隔 sample_interval 秒采样一次并记录峰值；
+    运行结束时输出JSON汇总，也可以开启本地的Prometheus文本格式接口。
+    metrics.enabled 关闭时所有记录方法直接返回。
+    """
+    def __init__(self):
+        self.enabled = bool(get_config("metrics", "enabled", True))
+        self.start = monotonic()
+        self.started_at = datetime.now()
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._gauges: Dict[str, Callable] = {}
+        self._gauge_last: Dict[Tuple[str, Labels], float] = {}
+        self._gauge_peak: Dict[Tuple[str, Labels], float] = {}
+        self._sampler = None
+        self._server = None
+        self._stop = threading.Event()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        """记录代码块的耗时，代码块抛出异常时同样记录"""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, monotonic() - start, buckets, **labels)
+
+    def register_gauge(self, name: str, fn: Callable):
+        """
+        注册仪表，采样时调用 fn
+        :param fn: 返回一个数值，或 [(标签dict, 数值)] 列表
+        """
+        with self._lock:
+            self._gauges[name] = fn
+
+    def sample(self):
+        """读取全部仪表的当前值，并更新峰值"""
+        if not self.enabled:
+            return
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = {}
+        for name, fn in gauges:
+            try:
+                result = fn()
+            except Exception as e:
+                logger.debug(f"读取指标{name}失败：{e}")
+                continue
+            if isinstance(result, (int, float)):
+                result = [({}, result)]
+            for labels, value in result:
+                values[(name, _labels(labels))] = float(value)
+        with self._lock:
+            self._gauge_last.update(values)
+            for key, value in values.items():
+                if value > self._gauge_peak.get(key, float("-inf")):
+                    self._gauge_peak[key] = value
+
+    def _sample_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            self.sample()
+
+    def start_sampler(self, interval: float = 1.0):
+        if not self.enabled or self._sampler is not None:
+            return
+        self._sampler = threading.Thread(target=self._sample_loop, args=(interval,), name="metrics-sampler",
+                                         daemon=True)
+        self._sampler.start()
+
+    def counter_total(self, name: str, **labels) -> float:
+        """计数器的合计值，只合计标签与 labels 相同的项"""
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(value for (counter, counter_labels), value in self._counters.items()
+                       if counter == name and wanted.issubset(counter_labels))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """名称为 name、标签包含 labels 的直方图合并后的结果"""
+        wanted = set(_labels(labels))
+        merged = None
+        with self._lock:
+            for (histogram_name, histogram_labels), histogram in self._histograms.items():
+                if histogram_name != name or not wanted.issubset(histogram_labels):
+                    continue
+                if merged is None:
+                    merged = Histogram(histogram.buckets)
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+                merged.max = max(merged.max, histogram.max)
+        return merged if merged is not None else Histogram(LATENCY_BUCKETS)
+
+    def snapshot(self) -> dict:
+        """全部指标的当前值，用于JSON汇总"""
+        self.sample()
+        elapsed = monotonic() - self.start
+        with self._lock:
+            counters, histograms, gauges = {}, {}, {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.snapshot()})
+            for (name, labels), value in sorted(self._gauge_last.items()):
+                gauges.setdefault(name, []).append({"labels": dict(labels), "last": value,
+                                                     "peak": self._gauge_peak.get((name, labels), value)})
+        downloaded = self.counter_total("download_bytes_total")
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 3),
+            "bytes_per_second": round(downloaded / elapsed, 1) if elapsed > 0 else 0,
+            "images_per_second": round(self.counter_total("images_total", result="downloaded") / elapsed, 3)
+            if elapsed > 0 else 0,
+            "counters": counters,
+            "histograms": histograms,
+            "gauges": gauges,
+        }
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        self.sample()
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"pika_{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), value in sorted(self._gauge_last.items()):
+                lines.append(f"pika_{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, n in zip(histogram.buckets, histogram.counts):
+                    cumulative += n
+                    le = 'le="%g"' % bound
+                    lines.append(f"pika_{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"pika_{name}_bucket{_format_labels(labels, le)} {histogram.count}")
+                lines.append(f"pika_{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"pika_{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int):
+        """在 127.0.0.1:port 提供 /metrics 接口（Prometheus文本格式）"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as e:
+            logger.warning(f"指标接口启动失败（端口{port}）：{e}")
+            return
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"指标接口：http://127.0.0.1:{port}/metrics")
+
+    def write_summary(self, path: str) -> Optional[dict]:
+        """把汇总写入 path（JSON），返回汇总内容"""
+        if not self.enabled:
+            return None
+        summary = self.snapshot()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+# 全局单例，其他模块导入后直接记录
+metrics = Metrics()
+
+def start_metrics():
+    """按配置开始采样，metrics.prometheus_port 不为0时开启本地指标接口"""
+    if not metrics.enabled:
+        return
+    metrics.start_sampler(float(get_config("metrics", "sample_interval", 1.0)))
+    port = int(get_config("metrics", "prometheus_port", 0))
+    if port:
+        metrics.serve(port)
+
+def close_metrics():
+    """把本次运行的指标汇总写入 metrics.summary_dir，并在日志中输出主要数据"""
+    if not metrics.enabled:
+        return
+    summary_dir = get_config("metrics", "summary_dir", "./logs")
+    path = os.path.join(summary_dir, f"metrics_{metrics.started_at.strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    try:
+        summary = metrics.write_summary(path)
+    except OSError as e:
+        logger.warning(f"保存指标汇总失败：{e}")
+    else:
+        request_count = sum(item["count"] for item in summary["histograms"].get("http_request_seconds", []))
+        logger.info(f"指标汇总：{request_count}次请求，{summary['images_per_second']}张/秒，"
+                    f"{summary['bytes_per_second'] / 1024:.0f}KB/秒 → {path}")
+    metrics.close()
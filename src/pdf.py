@@ -0,0 +1,173 @@
+import os
+import io
+import struct
+import zipfile
+from hashlib import md5
+from typing import Iterator, Optional, Tuple
+
+# 本模块在进程池的子进程中执行，只依赖标准库
+# 可选依赖：Pillow 用于转换非JPEG图片，pypdf（及 cryptography）用于加密PDF
+
+# JPEG中表示帧头（含宽高和颜色分量数）的标记
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class PdfWriter:
+    """
+    顺序写入的PDF文件：对象写完即落盘，最后写交叉引用表，
+    内存中只保留对象的偏移量，不保留图片数据
+    """
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.next_num = 1
+        self.file_id = md5(os.urandom(16)).digest()
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self) -> int:
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def write_object(self, num: int, body: bytes):
+        self.offsets[num] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    def write_stream(self, num: int, entries: bytes, data: bytes):
+        self.write_object(num, b"<< " + entries + b" /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+
+    def close(self, root: int):
+        xref_offset = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_num)
+        for num in range(1, self.next_num):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[num])
+        file_id = self.file_id.hex().encode()
+        trailer = b"<< /Size %d /Root %d 0 R /ID [<%s> <%s>]" % (self.next_num, root, file_id, file_id)
+        self.f.write(b"trailer\n" + trailer + b" >>\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
+
+def jpeg_info(data: bytes) -> Optional[Tuple[int, int, int, bool]]:
+    """
+    读取JPEG的宽、高、颜色分量数，以及是否为Adobe格式（CMYK需要反相）
+    不是JPEG时返回None
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    adobe = False
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xEE and data[pos + 4:pos + 9] == b"Adobe":
+            adobe = True
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height, data[pos + 9], adobe
+        pos += 2 + length
+    return None
+
+def to_jpeg(data: bytes) -> Optional[bytes]:
+    """把PNG、WebP等图片转换为JPEG，没有安装Pillow时返回None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            output = io.BytesIO()
+            image.convert("RGB").save(output, "JPEG", quality=95)
+            return output.getvalue()
+    except OSError:
+        return None
+
+def iter_chapter_images(source: str) -> Iterator[bytes]:
+    """按页码顺序逐张读取章节图片，source 为章节文件夹或 .cbz 压缩包"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                yield archive.read(name)
+        return
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isfile(path) and not name.endswith(".part"):
+            with open(path, "rb") as f:
+                yield f.read()
+
+def encrypt_pdf(path: str, password: str):
+    """
+    用pypdf把 path 加密为AES-256（打开需要密码），写完后重新读取，
+    确认密码能打开且页数不变，校验不通过时抛出异常，原文件不变
+    """
+    import pypdf
+    tmp_path = path + ".enc"
+    try:
+        writer = pypdf.PdfWriter(clone_from=path)
+        writer.encrypt(user_password=password, owner_password=password, algorithm="AES-256")
+        with open(tmp_path, "wb") as f:
+            writer.write(f)
+        reader = pypdf.PdfReader(tmp_path)
+        if not reader.is_encrypted or not reader.decrypt(password) or len(reader.pages) != len(writer.pages):
+            raise ValueError(f"加密后的PDF校验失败：{path}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def export_chapter_pdf(source: str, pdf_path: str, password: Optional[str] = None) -> Tuple[int, int]:
+    """
+    把章节图片按页码顺序写成PDF（每页一张图片，页面大小等于图片像素尺寸）
+    JPEG直接嵌入（DCTDecode），不重新编码；同一时间内存中只有一张图片
+    :param password: 打开PDF所需的密码，为空时不加密（见 encrypt_pdf）
+    :return: (写入的页数, 无法识别而跳过的图片数)，没有可写入的图片时不生成文件
+    """
+    tmp_path = pdf_path + ".part"
+    pages = []
+    skipped = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            writer = PdfWriter(f)
+            catalog = writer.reserve()
+            pages_num = writer.reserve()
+            for data in iter_chapter_images(source):
+                info = jpeg_info(data)
+                if info is None:
+                    data = to_jpeg(data) if data else None
+                    info = jpeg_info(data) if data else None
+                if info is None:
+                    skipped += 1
+                    continue
+                width, height, components, adobe = info
+                color_space = {1: b"/DeviceGray", 4: b"/DeviceCMYK"}.get(components, b"/DeviceRGB")
+                entries = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                           b"/BitsPerComponent 8 /Filter /DCTDecode" % (width, height, color_space))
+                if components == 4 and adobe:
+                    entries += b" /Decode [1 0 1 0 1 0 1 0]"
+                image_num = writer.reserve()
+                writer.write_stream(image_num, entries, data)
+                content_num = writer.reserve()
+                writer.write_stream(content_num, b"", b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (width, height))
+                page_num = writer.reserve()
+                writer.write_object(page_num, (
+                    b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] "
+                    b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                    % (pages_num, width, height, image_num, content_num)
+                ))
+                pages.append(page_num)
+            kids = b" ".join(b"%d 0 R" % num for num in pages)
+            writer.write_object(pages_num, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(pages)))
+            writer.write_object(catalog, b"<< /Type /Catalog /Pages %d 0 R >>" % pages_num)
+            writer.close(catalog)
+        if pages:
+            if password:
+                encrypt_pdf(tmp_path, password)
+            os.replace(tmp_path, pdf_path)
+        else:
+            os.remove(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(pages), skipped
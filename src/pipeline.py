@@ -0,0 +1,109 @@
+import threading
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from budget import BudgetExhausted, get_time_budget
+from metrics import metrics, DURATION_BUCKETS
+from events import emit_event
+from logger import  logger
+
+# 漫画来源的优先级，数字越小越先下载
+PRIORITY_FAVOURITE = 0  # 收藏夹
+PRIORITY_SUBSCRIBE = 1  # 关键词订阅
+PRIORITY_ALL = 2        # 分批下载全部漫画
+
+class BoundedExecutor:
+    """
+    给线程池加上全局在途任务上限：已提交但未完成的任务达到上限时，提交方阻塞等待。
+    提供与 ThreadPoolExecutor 相同的 submit 接口。
+    """
+    def __init__(self, executor: ThreadPoolExecutor, max_inflight: int):
+        self._executor = executor
+        self._semaphore = threading.BoundedSemaphore(max(max_inflight, 1))
+        self._lock = threading.Lock()
+        self.inflight = 0
+        metrics.register_gauge("images_inflight", lambda: self.inflight)
+
+    def submit(self, fn, *args, **kwargs):
+        self._semaphore.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        with self._lock:
+            self.inflight += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _):
+        with self._lock:
+            self.inflight -= 1
+        self._semaphore.release()
+
+class DownloadPipeline:
+    """
+    贯穿整个运行过程的下载流水线（线程引擎）
+
+    收藏夹、订阅、分批下载三种来源的漫画放进同一个持久化任务队列（见 jobqueue.JobQueue），
+    由 comic_workers 个漫画线程按优先级领取处理，所有图片共用一个下载线程池。
+    前一来源的收尾阶段可以和后一来源的开始阶段重叠；运行中断后下次启动从队列继续。
+    时间预算用完时停止领取漫画，等在途的章节下载完后结束。
+    """
+    def __init__(self, handle_comic, comic_workers: int, image_workers: int, max_inflight: int, jobs):
+        """
+        :param handle_comic: 处理单本漫画的函数，参数为 (comic, executor, check_favourite)，失败时抛出异常
+        :param comic_workers: 同时处理的漫画数
+        :param image_workers: 图片下载线程数
+        :param max_inflight: 已提交但未完成的图片下载数上限
+        :param jobs: JobQueue 实例
+        """
+        self.handle_comic = handle_comic
+        self.jobs = jobs
+        self._image_pool = ThreadPoolExecutor(max_workers=max(image_workers, 1))
+        self.executor = BoundedExecutor(self._image_pool, max_inflight)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"comic-worker-{i}", daemon=True)
+            for i in range(max(comic_workers, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, comic: dict, priority: int, check_favourite=False):
+        """加入一本待下载的漫画"""
+        self.jobs.put("comic", comic["_id"], {"comic": comic, "check_favourite": check_favourite}, priority)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if get_time_budget().expired():
+                self.jobs.release(job)
+                self.jobs.defer()
+                return
+            comic = job.payload["comic"]
+            started = monotonic()
+            status = "ok"
+            try:
+                with metrics.timer("comic_seconds", DURATION_BUCKETS):
+                    self.handle_comic(comic, self.executor, job.payload["check_favourite"])
+            except BudgetExhausted:
+                # 已开始的章节已经下载完，漫画留到下次运行继续
+                status = "deferred"
+                self.jobs.release(job)
+                self.jobs.defer()
+            except Exception as e:
+                status = "failed"
+                logger.error(f"漫画线程处理失败：{e}")
+                self.jobs.fail(job, str(e))
+            else:
+                self.jobs.done(job)
+            emit_event("comic", comic_id=comic["_id"], title=comic["title"], status=status,
+                       attempt=job.attempts, duration=round(monotonic() - started, 3))
+
+    def join(self):
+        """等待队列中的漫画全部处理完，然后关闭流水线"""
+        self.jobs.close()
+        for worker in self._workers:
+            worker.join()
+        self._image_pool.shutdown(wait=True)
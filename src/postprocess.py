@@ -0,0 +1,200 @@
+import importlib.util
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Optional
+from imageproc import process_chapter, FORMATS
+from blobstore import get_blob_store
+from util import get_config
+from metrics import metrics
+from logger import  logger
+
+class PostProcessor:
+    """
+    下载完成后的CPU处理阶段（PDF导出、图片重新压缩等）
+
+    任务在独立的进程池中执行，不占用下载线程，也不受GIL影响；
+    子进程以spawn方式启动，避免在多线程进程中fork。
+    背压：进程池中的任务不超过 max_pending 个，超出的任务只在内存中记下参数，
+    等有任务完成时再提交。提交方从不等待，CPU处理跟不上时也不会拖慢下载。
+    """
+    def __init__(self, max_workers: int, max_pending: int):
+        self.executor = ProcessPoolExecutor(max_workers=max(max_workers, 1),
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self.max_pending = max(max_pending, 1)
+        self.deferred_count = 0
+        self._deferred = deque()
+        self._running = 0
+        self._cond = threading.Condition()
+        metrics.register_gauge("postprocess_pending", lambda: self._running + len(self._deferred))
+
+    def submit(self, fn, *args, on_done=None):
+        with self._cond:
+            if self._running >= self.max_pending:
+                self._deferred.append((fn, args, on_done))
+                self.deferred_count += 1
+                return
+            self._running += 1
+        self._start(fn, args, on_done)
+
+    def _start(self, fn, args, on_done):
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception as e:
+            logger.error(f"后处理任务提交失败：{e}")
+            self._next()
+            return
+        future.add_done_callback(partial(self._finished, on_done))
+
+    def _finished(self, on_done, future):
+        try:
+            if on_done is not None:
+                on_done(future)
+        except Exception as e:
+            logger.error(f"后处理结果处理失败：{e}")
+        finally:
+            self._next()
+
+    def _next(self):
+        """一个任务结束后提交下一个暂存的任务"""
+        with self._cond:
+            if self._deferred:
+                task = self._deferred.popleft()
+            else:
+                task = None
+                self._running -= 1
+                self._cond.notify_all()
+        if task is not None:
+            self._start(*task)
+
+    def join(self):
+        """等待已提交和暂存的任务全部完成，然后关闭进程池"""
+        with self._cond:
+            while self._running:
+                self._cond.wait()
+        self.executor.shutdown(wait=True)
+
+_post_processor = None
+_post_processor_lock = threading.Lock()
+
+def get_post_processor() -> PostProcessor:
+    """
+    获取全局共享的进程池，进程数取 download.postprocess_workers（0为CPU核数），
+    排队上限取 download.postprocess_queue（0为进程数的2倍）
+    """
+    global _post_processor
+    if _post_processor is None:
+        with _post_processor_lock:
+            if _post_processor is None:
+                workers = int(get_config("download", "postprocess_workers", 0)) or os.cpu_count() or 1
+                max_pending = int(get_config("download", "postprocess_queue", 0)) or workers * 2
+                _post_processor = PostProcessor(workers, max_pending)
+    return _post_processor
+
+def close_post_processor():
+    """等待进程池中的任务完成并关闭（没有使用过进程池时不做任何事）"""
+    global _post_processor
+    if _post_processor is not None:
+        logger.info("等待后处理任务完成")
+        _post_processor.join()
+        if _post_processor.deferred_count:
+            logger.info(f"后处理繁忙时共有{_post_processor.deferred_count}个章节延后处理")
+        _post_processor = None
+
+def pdf_password() -> Optional[str]:
+    password = get_config("pdf", "pdf_password")
+    # 配置文件中的 None 读出来是字符串
+    return None if password in (None, "", "None") else str(password)
+
+_pypdf_missing_logged = False
+
+def pdf_encryption_available() -> bool:
+    """加密PDF（AES-256）需要pypdf和cryptography，没有安装时只提示一次"""
+    global _pypdf_missing_logged
+    if importlib.util.find_spec("pypdf") is not None and importlib.util.find_spec("cryptography") is not None:
+        return True
+    if not _pypdf_missing_logged:
+        _pypdf_missing_logged = True
+        logger.warning("设置了PDF密码，但加密PDF需要安装pypdf和cryptography（pip install pypdf cryptography），"
+                       "本次不生成PDF")
+    return False
+
+_pillow_missing_logged = False
+_blob_store_skip_logged = False
+
+def recompress_options() -> Optional[tuple]:
+    """
+    按 download.recompress 返回重新压缩的 (格式, 质量, 最大宽度)，不压缩时返回None
+    重新压缩需要Pillow，没有安装时只提示一次
+    """
+    global _pillow_missing_logged
+    fmt = str(get_config("download", "recompress", "none")).lower()
+    if fmt not in FORMATS:
+        return None
+    if importlib.util.find_spec("PIL") is None:
+        if not _pillow_missing_logged:
+            _pillow_missing_logged = True
+            logger.warning("重新压缩图片需要安装Pillow（pip install pillow），本次不压缩")
+        return None
+    quality = int(get_config("download", "recompress_quality", 80))
+    max_width = int(get_config("download", "recompress_max_width", 0))
+    return fmt, quality, max_width
+
+def submit_chapter(db, cid, episode, chapter_path: Path, archive=None):
+    """
+    章节下载完整后，在进程池中执行后处理：
+    按 pdf.pdf_switch 生成 <章节>.pdf（pdf.pdf_password 不为空时加密），
+    再按 download.recompress 重新压缩图片，处理前后的总大小记录到 episodes 表，
+    开启 image_ledger 时每张图片的大小另记录到 images 表
+    :param archive: 章节压缩包（见 archive.ChapterArchive），为None时处理章节文件夹
+    """
+    global _blob_store_skip_logged
+    pdf_path = str(chapter_path) + ".pdf" if get_config("pdf", "pdf_switch", False) else None
+    password = pdf_password()
+    if pdf_path is not None and password is not None and not pdf_encryption_available():
+        # 不能加密时不生成PDF，避免留下未加密的文件
+        pdf_path = None
+    options = recompress_options()
+    if options is not None and archive is None and get_blob_store() is not None:
+        # 章节文件夹中的图片是图片仓库的硬链接，重新压缩只会断开链接，原图仍留在仓库中，占用反而更多
+        if not _blob_store_skip_logged:
+            _blob_store_skip_logged = True
+            logger.warning("开启图片仓库（blob_store）且输出为文件夹时不重新压缩图片")
+        options = None
+    if pdf_path is None and options is None:
+        return
+    source = archive.path if archive is not None else str(chapter_path)
+    use_ledger = get_config("download", "image_ledger", False)
+    get_post_processor().submit(process_chapter, source, pdf_path, password, options,
+                                on_done=partial(_chapter_done, db, cid, episode, source, pdf_path,
+                                                options and options[0], use_ledger))
+
+def _chapter_done(db, cid, episode, source: str, pdf_path: Optional[str], fmt: Optional[str], use_ledger,
+                  future):
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error(f"后处理失败：{source}，{e}")
+        return
+    if pdf_path is not None:
+        _log_pdf_result(pdf_path, *result["pdf"])
+    sizes = result["sizes"]
+    if sizes:
+        before = sum(size for _, size, _ in sizes)
+        after = sum(size for _, _, size in sizes)
+        db.update_episode_processed(cid, episode["title"], fmt, before, after)
+        if use_ledger:
+            db.update_processed_sizes(cid, episode["order"], fmt, [(index, size) for index, _, size in sizes])
+        logger.info(f"重新压缩{source}：{len(sizes)}张图片，{before / 1024:.0f}KB → {after / 1024:.0f}KB")
+
+def _log_pdf_result(pdf_path: str, pages: int, skipped: int):
+    if not pages:
+        logger.warning(f"没有生成PDF：{pdf_path}，{skipped}张图片都无法识别")
+    elif skipped:
+        logger.warning(f"生成PDF：{pdf_path}，共{pages}页，{skipped}张图片无法识别已跳过")
+    else:
+        logger.info(f"生成PDF：{pdf_path}，共{pages}页")
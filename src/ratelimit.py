@@ -0,0 +1,171 @@
+import asyncio
+import random
+import threading
+from time import monotonic, sleep
+from util import get_config
+from metrics import metrics
+from logger import  logger
+
+# 需要退避重试的状态码：限流和服务器错误
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """令牌桶：平均每秒放行 rate 个请求，允许 capacity 个突发。rate<=0 表示不限速"""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """取一个令牌，成功时返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            sleep(wait)
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class HostLimiter:
+    """
+    单个主机的自适应限流器
+
+    令牌桶控制请求速率；并发上限按AIMD调整：
+    请求正常时加性增长（大约每轮并发+1），出现超时/429/5xx时减半，
+    两次减半之间至少间隔 cooldown 秒，避免同一波失败把并发一下压到最低。
+    线程用 acquire 等待名额，asyncio引擎的协程用 acquire_async，两者共用同一个并发上限。
+    """
+    def __init__(self, host: str, rate: float, max_concurrency: int,
+                 min_concurrency: int = 1, cooldown: float = 1.0):
+        self.host = host
+        self.bucket = TokenBucket(rate, max_concurrency)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.limit = float(self.max_concurrency)
+        self.inflight = 0
+        self.cooldown = cooldown
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+        self.bucket.acquire()
+
+    async def acquire_async(self):
+        """acquire 的协程版本：等待期间不占用线程，任意线程 release 后唤醒"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    break
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            await waiter
+        await self.bucket.acquire_async()
+
+    def release(self, congested: bool):
+        with self._cond:
+            self.inflight -= 1
+            if congested:
+                now = monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    logger.warning(f"{self.host} 响应异常，并发上限降为{int(self.limit)}")
+            elif self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for waiter in waiters:
+            try:
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+class HostSlot:
+    """
+    一次请求占用的主机并发名额，release 只生效一次
+
+    流式下载在读完正文、关闭响应时才释放（见 api.http_do），
+    读取正文时的超时和连接中断也能作为拥塞信号反馈给限流器。
+    """
+    def __init__(self, limiter: HostLimiter):
+        self.limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, congested: bool = False):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.limiter.release(congested=congested)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(host: str) -> HostLimiter:
+    """
+    获取主机对应的限流器（每个主机一个，全局共享）
+    速率取 download.rate_limit（每秒请求数，0为不限速），并发上限取 download.host_concurrency
+    """
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                thread_number = int(get_config("download", "thread_number", 5))
+                rate = float(get_config("download", "rate_limit", 0))
+                max_concurrency = int(get_config("download", "host_concurrency", thread_number))
+                limiter = HostLimiter(host, rate, max_concurrency)
+                _limiters[host] = limiter
+    return limiter
+
+def _limiter_gauge(field: str):
+    return lambda: [({"host": host}, getattr(limiter, field)) for host, limiter in list(_limiters.items())]
+
+# 每个主机进行中的请求数和当前并发上限，两者之比即连接的利用率
+metrics.register_gauge("host_inflight", _limiter_gauge("inflight"))
+metrics.register_gauge("host_concurrency_limit", _limiter_gauge("limit"))
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """带随机抖动的指数退避时间（full jitter）：在 [0, min(cap, base*2^attempt)] 内随机"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def retry_delay(response, attempt: int) -> float:
+    """优先使用服务器返回的 Retry-After，否则使用指数退避"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), 60.0)
+    return backoff_delay(attempt)
@@ -0,0 +1,123 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from util import get_config
+from metrics import metrics
+from logger import  logger
+
+class PoolStats:
+    """连接池命中统计（按主机区分，线程安全）"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # 每个主机从连接池取连接的次数
+        self.misses = {}    # 每个主机真正建立TCP(+TLS)连接的次数
+
+    def record_request(self, host):
+        with self._lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+
+    def record_miss(self, host):
+        with self._lock:
+            self.misses[host] = self.misses.get(host, 0) + 1
+
+    def snapshot(self) -> dict:
+        """
+        返回各主机的统计数据
+        :return: {host: {"requests": 请求数, "hits": 复用连接数, "misses": 新建连接数}}
+        """
+        with self._lock:
+            result = {}
+            for host, total in self.requests.items():
+                misses = self.misses.get(host, 0)
+                result[host] = {
+                    "requests": total,
+                    "hits": max(total - misses, 0),
+                    "misses": misses,
+                }
+            return result
+
+    def summary(self) -> str:
+        lines = []
+        for host, stat in self.snapshot().items():
+            rate = stat["hits"] / stat["requests"] * 100 if stat["requests"] else 0
+            lines.append(
+                f"{host} 请求:{stat['requests']} 复用:{stat['hits']} "
+                f"新建连接:{stat['misses']} 命中率:{rate:.1f}%"
+            )
+        return "; ".join(lines) if lines else "无请求"
+
+pool_stats = PoolStats()
+metrics.register_gauge("pool_new_connections", lambda: [
+    ({"host": host}, stat["misses"]) for host, stat in pool_stats.snapshot().items()])
+metrics.register_gauge("pool_reused_connections", lambda: [
+    ({"host": host}, stat["hits"]) for host, stat in pool_stats.snapshot().items()])
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        pool_stats.record_miss(self.host)
+        super().connect()
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        pool_stats.record_miss(self.host)
+        super().connect()
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+    def _get_conn(self, timeout=None):
+        pool_stats.record_request(self.host)
+        return super()._get_conn(timeout=timeout)
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        pool_stats.record_request(self.host)
+        return super()._get_conn(timeout=timeout)
+
+class PooledAdapter(HTTPAdapter):
+    """在requests默认适配器基础上统计连接复用情况"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    获取全局共享的keep-alive会话。
+
+    每个主机一个连接池，连接池大小与 download.thread_number 一致，
+    下载线程之间复用同一批TCP/TLS连接，避免每张图片都重新握手。
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                thread_number = int(get_config(section="download", key="thread_number", default_value=5))
+                pool_size = max(thread_number, 1)
+                adapter = PooledAdapter(
+                    pool_connections=10,  # 缓存的主机连接池个数（API服务器+若干图片服务器）
+                    pool_maxsize=pool_size,  # 每个主机保持的最大空闲连接数
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                logger.info(f"初始化HTTP连接池，每个主机最多保持{pool_size}个连接")
+    return _session
+
+def close_session():
+    """关闭全局会话并释放全部连接"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,65 @@
+from typing import Optional
+from api import episodes_all, episodes_since
+from logger import  logger
+
+def is_comic_unchanged(state: Optional[dict], comic: dict) -> bool:
+    """
+    列表（收藏夹、搜索结果等）中漫画的更新时间和章节数与数据库记录一致，
+    且已下载章节数不少于章节数时，认为漫画没有需要同步的内容
+    """
+    if state is None or not state["epsCount"]:
+        return False
+    if "updated_at" not in comic and "epsCount" not in comic:
+        return False
+    if "updated_at" in comic and comic["updated_at"] != state["update_time"]:
+        return False
+    if "epsCount" in comic and comic["epsCount"] != state["epsCount"]:
+        return False
+    return state["episode_count"] >= state["epsCount"]
+
+def pending_episodes(db, comic: dict, version: str = None, incremental: bool = True) -> Optional[list]:
+    """
+    获取漫画中尚未下载的章节（按order排序）
+    增量模式（download.incremental）下：
+      - 漫画没有更新时不请求章节列表，返回None；
+      - 已下载章节的序号连续（1..最大序号都已下载）时，只获取序号更大的新章节；
+      - 否则获取全部章节，并为旧数据中缺少序号的已下载章节补全序号。
+    :param db: ComicSQLiteDB 实例
+    :param version: 漫画的版本标识（见 api.comic_version）
+    """
+    cid = comic["_id"]
+    title = comic["title"]
+    plan = sync_plan(db, comic, incremental)
+    if plan is None:
+        return None
+    state, min_order = plan
+    if min_order is not None:
+        episodes = episodes_since(cid, title, min_order, version)
+    else:
+        episodes = episodes_all(cid, title, version)
+    return filter_downloaded(db, cid, state, episodes, incremental)
+
+def sync_plan(db, comic: dict, incremental: bool = True) -> Optional[tuple]:
+    """
+    pending_episodes 获取章节列表之前的判断，asyncio引擎也使用
+    :return: 漫画没有更新时返回None，否则返回 (同步状态, min_order)；
+             min_order 不为None时只需获取序号大于它的章节
+    """
+    state = db.get_sync_state(comic["_id"]) if incremental else None
+    if is_comic_unchanged(state, comic):
+        logger.info(f"{comic['title']}没有更新，跳过")
+        return None
+    if state and state["max_order"] and state["ordered_count"] >= state["max_order"]:
+        return state, state["max_order"]
+    return state, None
+
+def filter_downloaded(db, cid, state: Optional[dict], episodes: list, incremental: bool = True) -> list:
+    """从章节列表中去掉已下载的章节，需要时为旧数据补全章节序号"""
+    if state is not None or db.is_comic_downloaded(cid):
+        downloaded_episodes = db.get_downloaded_episodes(cid)
+        if incremental and state and state["ordered_count"] < state["episode_count"]:
+            db.backfill_episode_orders(cid, [episode for episode in episodes
+                                             if episode["title"] in downloaded_episodes])
+        episodes = [episode for episode in episodes
+                    if episode["title"] not in downloaded_episodes]
+    return episodes
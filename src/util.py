@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 import yaml
 import os
 from datetime import datetime, timezone
@@ -10,7 +12,7 @@ max_path_length = 110
 def generate_default_config():
     """生成默认配置文件（初次运行时自动创建）"""
     default_config = {
-        "global": {
+        "pdf": {
             "pdf_switch": 0,
             "pdf_password": "None"
         }
@@ -29,23 +31,168 @@ def load_config():
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
+def to_bool(value) -> bool:
+    """把配置值转换为布尔值，支持环境变量中的 true/false、1/0、yes/no、on/off"""
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ("true", "1", "yes", "on"):
+            return True
+        if lowered in ("false", "0", "no", "off", ""):
+            return False
+        raise ValueError(value)
+    return bool(value)
+
+class Config:
+    """
+    comic.yaml 的内存缓存
+
+    配置文件只在修改时间变化时重新解析（最多每 check_interval 秒检查一次），
+    读取时环境变量优先，并按 SCHEMA 中声明的类型转换，
+    例如环境变量 THREAD_NUMBER=8 读出来是 int 而不是字符串。
+    """
+    SCHEMA = {
+        "global": {
+            "USER_NAME": str,
+            "USER_PASSWORD": str,
+            "api_base": str,
+        },
+        "pdf": {
+            "pdf_switch": to_bool,
+            "pdf_password": str,
+        },
+        "download": {
+            "is_detail": to_bool,
+            "engine": str,
+            "thread_number": int,
+            "host_concurrency": int,
+            "rate_limit": float,
+            "max_inflight": int,
+            "comic_workers": int,
+            "page_concurrency": int,
+            "stream_download": to_bool,
+            "image_ledger": to_bool,
+            "incremental": to_bool,
+            "blob_store": to_bool,
+            "blob_dir": str,
+            "output_format": str,
+            "postprocess_workers": int,
+            "postprocess_queue": int,
+            "recompress": str,
+            "recompress_quality": int,
+            "recompress_max_width": int,
+            "job_lease": float,
+            "job_max_attempts": int,
+            "time_budget": float,
+            "time_budget_reserve": float,
+            "remove_favorites": to_bool,
+            "out_time_day": int,
+            "key_world": str,
+            "filter": str,
+            "page": int,
+            "download_plan": int,
+        },
+        "cache": {
+            "enabled": to_bool,
+            "db_path": str,
+            "max_mb": int,
+            "ttl_comic_info": float,
+            "ttl_eps": float,
+            "ttl_pages": float,
+        },
+        "logging": {
+            "queue": to_bool,
+            "console_level": str,
+            "file_level": str,
+            "module_levels": str,
+            "events": to_bool,
+            "events_dir": str,
+        },
+        "metrics": {
+            "enabled": to_bool,
+            "summary_dir": str,
+            "sample_interval": float,
+            "prometheus_port": int,
+        },
+    }
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._data = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _convert(self, section: str, key: str, value):
+        converter = self.SCHEMA.get(section, {}).get(key)
+        if converter is None or value is None:
+            return value
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"配置项 {section}.{key} 的值 {value!r} 无法转换为 {getattr(converter, '__name__', converter)}")
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            self._checked = now
+            mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+            if self._mtime is not None and mtime == self._mtime:
+                return
+            raw = load_config() or {}
+            data = {}
+            for section, values in raw.items():
+                values = values or {}
+                data[section] = {key: self._convert(section, key, value) for key, value in values.items()}
+            self._data = data
+            if self._mtime is not None:
+                logger.info(f"检测到配置文件变化，已重新加载 → {self.path}")
+            self._mtime = mtime
+
+    # 系统自带的环境变量，不作为不带段名的配置覆盖
+    RESERVED_ENV = {"PATH", "HOME", "USER", "SHELL", "PWD", "LANG", "TERM", "TMP", "TEMP", "TMPDIR", "HOSTNAME"}
+
+    @classmethod
+    def env_names(cls, section: str, key: str) -> list:
+        """
+        可以覆盖 section.key 的环境变量名，按顺序查找：
+        <SECTION>_<KEY>（如 CACHE_ENABLED、DOWNLOAD_PAGE），再兼容旧的只用键名的写法（如 THREAD_NUMBER），
+        与系统环境变量同名的键名（见 RESERVED_ENV）除外
+        """
+        names = [f"{section}_{key}".upper()]
+        if key.upper() not in cls.RESERVED_ENV:
+            names.append(key.upper())
+        return names
+
+    def get(self, section: str, key: str, default_value=''):
+        # 环境变量优先
+        for name in self.env_names(section, key):
+            env_value = os.environ.get(name)
+            if env_value:
+                return self._convert(section, key, env_value)
+        self._reload_if_changed()
+        value = self._data.get(section, {}).get(key)
+        if value is None or value == '':
+            return default_value
+        return value
+
+    def section(self, section: str) -> dict:
+        """返回整个配置段（已转换类型，不含环境变量覆盖）"""
+        self._reload_if_changed()
+        return dict(self._data.get(section, {}))
+
+config = Config(CONFIG_PATH)
+
 def get_config(section: str, key: str, default_value = ''):
     """
     读取配置
-    读取优先级为 环境变量 > config.ini > default_value默认值
+    读取优先级为 环境变量 > comic.yaml > default_value默认值
+    环境变量名为 <段名>_<键名> 的大写，也可以只用键名（见 Config.env_names）
+    配置文件解析结果缓存在内存中，文件修改后自动重新加载
     """
-    #先读取环境变量
-    config_value = os.environ.get(key.upper())
-    if config_value:
-        return config_value
-    #从配置文件中寻找
-    config = load_config()
-    config = config[section]
-    config_value = config[key]
-    if config_value:
-        return config_value
-    #都没有返回默认值
-    return default_value
+    return config.get(section, key, default_value)
 
 def print_full_json(json_data):
     """打印完整的JSON响应"""